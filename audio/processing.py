@@ -1,47 +1,349 @@
+import collections
+import contextlib
+import functools
+import hashlib
+import io
+import itertools
+import math
+import os
+import tempfile
+import struct
+import threading
 import wave
 import numpy as np
-from scipy.signal import resample
-
-def load_wave(file_path):
-    with wave.open(file_path, 'rb') as wav_file:
-        sample_rate = wav_file.getframerate()
-        n_channels = wav_file.getnchannels()
-        frames = wav_file.readframes(wav_file.getnframes())
-        data = np.frombuffer(frames, dtype=np.int16).copy()
-        if n_channels > 1:
-            data = data.reshape(-1, n_channels)
-    return sample_rate, data
-
-def save_wave(file_path, sample_rate, data):
-    n_channels = data.shape[1] if len(data.shape) > 1 else 1
-    with wave.open(file_path, 'wb') as wav_file:
+
+RESAMPLE_BLOCK = 1 << 16
+# WAV headers are parsed from a prefix of the file; chunks before the data chunk may not push it past MAX_HEADER_SIZE
+HEADER_PREFIX = 4096
+MAX_HEADER_SIZE = 1024 * 1024
+
+# 8-bit PCM is unsigned, 24-bit samples are sign-extended into int32
+SAMPLE_DTYPES = {1: np.uint8, 2: np.int16, 3: np.int32, 4: np.int32}
+# WAVE_FORMAT_EXTENSIBLE is what ffmpeg and most DAWs write for more than 16 bits, 2 channels or 48 kHz;
+# its SubFormat GUID says whether the samples are plain PCM
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+KSDATAFORMAT_SUBTYPE_PCM = b'\x01\x00\x00\x00\x00\x00\x10\x00\x80\x00\x00\xaa\x00\x38\x9b\x71'
+
+def sample_width(data):
+    return {np.dtype(np.uint8): 1, np.dtype(np.int32): 4}.get(data.dtype, 2)
+
+def decode_frames(frames, sampwidth, n_channels):
+    if sampwidth not in SAMPLE_DTYPES:
+        raise wave.Error(f"unsupported sample width: {sampwidth}")
+    if sampwidth == 3:
+        raw = np.frombuffer(frames, dtype=np.uint8).reshape(-1, 3)
+        padded = np.zeros((len(raw), 4), dtype=np.uint8)
+        padded[:, 1:] = raw
+        data = padded.view('<i4').reshape(-1) >> 8
+    else:
+        data = np.frombuffer(frames, dtype=SAMPLE_DTYPES[sampwidth])
+    if n_channels > 1:
+        data = data.reshape(-1, n_channels)
+    return data
+
+def encode_frames(data, sampwidth):
+    if sampwidth == 3:
+        padded = np.ascontiguousarray(data, dtype='<i4').reshape(-1, 1).view(np.uint8)
+        return padded[:, :3].tobytes()
+    return memoryview(np.ascontiguousarray(data, dtype=SAMPLE_DTYPES[sampwidth])).cast('B')
+
+def to_int16_scale(data, sampwidth):
+    data = data.astype(np.float32)
+    if sampwidth == 1:
+        return (data - 128) * 256
+    return data / (1 << (8 * sampwidth - 16))
+
+def is_path(source):
+    return isinstance(source, (str, os.PathLike))
+
+def as_file(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    return source
+
+def open_wave(source, mode='rb'):
+    # Sources may be paths, raw bytes or seekable file-like objects; the latter are always read from the start
+    source = as_file(source)
+    if not is_path(source):
+        source.seek(0)
+        if mode == 'wb':
+            source.truncate()
+    return wave.open(source, mode)
+
+def open_binary(source):
+    source = as_file(source)
+    if is_path(source):
+        return open(source, 'rb')
+    source.seek(0)
+    return contextlib.nullcontext(source)
+
+def read_bytes(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return source
+    with open_binary(source) as f:
+        return f.read()
+
+def load_wave(file_path, return_sampwidth=False):
+    # Read through read_wav_info rather than wave, which rejects WAVE_FORMAT_EXTENSIBLE before Python 3.12
+    info = read_wav_info(file_path)
+    data = read_frames(file_path, 0, info.nframes, info)
+    if not data.flags.writeable:
+        data = data.copy()
+    if return_sampwidth:
+        return info.framerate, data, info.sampwidth
+    return info.framerate, data
+
+def read_frames(file_path, start, count, info=None):
+    # Seeks straight to the requested frames; pass the descriptor from read_wav_info to skip re-parsing the header
+    info = info or read_wav_info(file_path)
+    frame_size = info.nchannels * info.sampwidth
+    start = min(start, info.nframes)
+    count = max(0, min(count, info.nframes - start))
+    with open_binary(file_path) as wav_file:
+        wav_file.seek(info.data_offset + start * frame_size)
+        frames = wav_file.read(count * frame_size)
+    return decode_frames(frames, info.sampwidth, info.nchannels)
+
+WavInfo = collections.namedtuple('WavInfo', 'nchannels sampwidth framerate nframes data_offset')
+
+def parse_wav_header(header):
+    # Returns None when `header` ends before the start of the data chunk
+    if len(header) < 12:
+        return None
+    riff, _, wave_id = struct.unpack_from('<4sI4s', header)
+    if riff != b'RIFF' or wave_id != b'WAVE':
+        raise wave.Error("file does not start with RIFF/WAVE id")
+    position, fmt = 12, None
+    while True:
+        if len(header) < position + 8:
+            return None
+        chunk_id, size = struct.unpack_from('<4sI', header, position)
+        position += 8
+        if chunk_id == b'fmt ':
+            if len(header) < position + 16:
+                return None
+            format_tag, nchannels, framerate, _, block_align, bits = struct.unpack_from('<HHIIHH', header, position)
+            sampwidth = (bits + 7) // 8
+            if format_tag == WAVE_FORMAT_EXTENSIBLE:
+                if size < 40:
+                    raise wave.Error("bad fmt chunk")
+                if len(header) < position + 40:
+                    return None
+                if header[position + 24:position + 40] != KSDATAFORMAT_SUBTYPE_PCM:
+                    raise wave.Error("unknown extensible sub-format")
+            elif format_tag != wave.WAVE_FORMAT_PCM:
+                raise wave.Error(f"unknown format: {format_tag}")
+            if (nchannels < 1 or framerate < 1 or sampwidth not in SAMPLE_DTYPES
+                    or block_align != nchannels * sampwidth):
+                raise wave.Error("bad fmt chunk")
+            fmt = (nchannels, sampwidth, framerate)
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise wave.Error("data chunk before fmt chunk")
+            return WavInfo(*fmt, size // (fmt[0] * fmt[1]), position)
+        position += size + (size & 1)
+        if position > MAX_HEADER_SIZE:
+            raise wave.Error("data chunk not found")
+
+def read_wav_info(file_path):
+    # Validates the RIFF/fmt header from the first few KB; the descriptor can be reused for every later read
+    with open_binary(file_path) as wav_file:
+        header = wav_file.read(HEADER_PREFIX)
+        info = parse_wav_header(header)
+        while info is None:
+            more = wav_file.read(len(header))
+            if not more:
+                raise wave.Error("truncated WAV header")
+            header += more
+            info = parse_wav_header(header)
+        size = wav_file.seek(0, io.SEEK_END)
+    # Like wave, only the frames actually present count, whatever the data chunk claims
+    available = max(0, size - info.data_offset) // (info.nchannels * info.sampwidth)
+    return info._replace(nframes=min(info.nframes, available))
+
+def probe_wav(file_path):
+    try:
+        return read_wav_info(file_path)
+    except (wave.Error, EOFError, OSError):
+        return None
+
+def build_wave(info, frames):
+    output = io.BytesIO()
+    with wave.open(output, 'wb') as wav_file:
+        wav_file.setnchannels(info.nchannels)
+        wav_file.setsampwidth(info.sampwidth)
+        wav_file.setframerate(info.framerate)
+        wav_file.writeframes(frames)
+    return output.getvalue()
+
+def save_wave(file_path, sample_rate, data, sampwidth=None):
+    save_wave_blocks(file_path, sample_rate, [data], sampwidth)
+
+def save_wave_blocks(file_path, sample_rate, blocks, sampwidth=None):
+    # `blocks` may be a generator, so only one block needs to be in memory at a time
+    blocks = iter(blocks)
+    first = next(blocks)
+    n_channels = first.shape[1] if len(first.shape) > 1 else 1
+    sampwidth = sampwidth or sample_width(first)
+    with open_wave(file_path, 'wb') as wav_file:
         wav_file.setnchannels(n_channels)
-        wav_file.setsampwidth(2)
+        wav_file.setsampwidth(sampwidth)
         wav_file.setframerate(sample_rate)
-        wav_file.writeframes(data.astype(np.int16).tobytes())
-
-def resample_audio(audio_data, original_rate, target_rate):
-    float_data = audio_data.astype(np.float32) / 32768.0
-    num_samples = int(audio_data.shape[0] * (target_rate / original_rate))
-    resampled_float = resample(float_data, num_samples, axis=0)
-    resampled_int16 = np.clip(resampled_float * 32768, -32768, 32767).astype(np.int16)
-    return resampled_int16
-
-async def resample_audio_inplace(file_path, target_sample_rate=44100):
-    sample_rate, audio_data = load_wave(file_path)
-    if sample_rate == target_sample_rate:
+        for block in itertools.chain([first], blocks):
+            # Writing through a memoryview avoids a tobytes() copy of every block
+            if len(block):
+                wav_file.writeframes(encode_frames(block, sampwidth))
+
+@functools.lru_cache(maxsize=32)
+def polyphase_filter(up, down):
+    # Same Kaiser design as scipy.signal.resample_poly, padded so output sample 0 lands on a whole output index
+    from scipy.signal import firwin
+
+    max_rate = max(up, down)
+    half_len = 10 * max_rate
+    h = firwin(2 * half_len + 1, 1.0 / max_rate, window=('kaiser', 5.0)) * up
+    n_pre_pad = down - half_len % down
+    h = np.concatenate((np.zeros(n_pre_pad), h)).astype(np.float32)
+    delay = (half_len + n_pre_pad) // down
+    context = (len(h) // up // down + 1) * down
+    return h, delay, context
+
+def resample_blocks(read, n_frames, original_rate, target_rate, block_size=RESAMPLE_BLOCK):
+    if original_rate == target_rate:
+        for start in range(0, n_frames, block_size):
+            block = read(start, min(block_size, n_frames - start))
+            yield np.clip(block, -32768, 32767).astype(np.int16)
+        return
+
+    # scipy is imported lazily so decode-only processes never pay for it
+    from scipy.signal import upfirdn
+
+    ratio = math.gcd(original_rate, target_rate)
+    up, down = target_rate // ratio, original_rate // ratio
+    h, delay, context = polyphase_filter(up, down)
+    n_out = -(-n_frames * up // down)
+    block_size = max(1, block_size // down) * down
+
+    # Blocks start on multiples of `down`, so each maps to a whole range of output samples;
+    # `context` frames on either side cover the filter support across block edges
+    for start in range(0, n_frames, block_size):
+        count = min(block_size, n_frames - start)
+        lo, hi = start - context, start + count + context
+        window = read(max(lo, 0), min(hi, n_frames) - max(lo, 0))
+        pad = [(max(0, -lo), max(0, hi - n_frames))] + [(0, 0)] * (window.ndim - 1)
+        window = np.pad(window, pad)
+
+        filtered = upfirdn(h, window, up, down, axis=0)
+        out_start = start * up // down
+        out_end = n_out if start + count == n_frames else (start + count) * up // down
+        first = delay + context * up // down
+        yield np.clip(filtered[first:first + out_end - out_start], -32768, 32767).astype(np.int16)
+
+def resample_audio(audio_data, original_rate, target_rate, sampwidth=None):
+    sampwidth = sampwidth or sample_width(audio_data)
+    blocks = resample_blocks(
+        lambda start, count: to_int16_scale(audio_data[start:start + count], sampwidth),
+        len(audio_data), original_rate, target_rate
+    )
+    return np.concatenate(list(blocks) or [audio_data[:0].astype(np.int16)])
+
+def resample_file(source_path, output_path, target_sample_rate=44100):
+    info = read_wav_info(source_path)
+
+    def read(start, count):
+        return to_int16_scale(read_frames(source_path, start, count, info), info.sampwidth)
+
+    with open_wave(output_path, 'wb') as output:
+        output.setnchannels(info.nchannels)
+        output.setsampwidth(2)
+        output.setframerate(target_sample_rate)
+        for block in resample_blocks(read, info.nframes, info.framerate, target_sample_rate):
+            output.writeframes(memoryview(block).cast('B'))
+
+def resample_audio_inplace(file_path, target_sample_rate=44100):
+    # Output is always 16-bit, so this also narrows 24/32-bit files already at the target rate
+    info = read_wav_info(file_path)
+    if info.framerate == target_sample_rate and info.sampwidth == 2:
         return
-    resampled_data = resample_audio(audio_data, sample_rate, target_sample_rate)
-    save_wave(file_path, target_sample_rate, resampled_data)
+    if not is_path(file_path):
+        resampled = io.BytesIO()
+        resample_file(file_path, resampled, target_sample_rate)
+        file_path.seek(0)
+        file_path.truncate()
+        file_path.write(resampled.getbuffer())
+        return
+    fd, temp_path = tempfile.mkstemp(suffix=".wav", dir=os.path.dirname(os.path.abspath(file_path)))
+    os.close(fd)
+    try:
+        resample_file(file_path, temp_path, target_sample_rate)
+        os.replace(temp_path, file_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
 
 def loop_audio(audio, target_length):
     repetitions = (target_length + len(audio) - 1) // len(audio)
-    looped_audio = np.tile(audio, (repetitions, 1))
+    looped_audio = np.tile(audio, (repetitions,) + (1,) * (audio.ndim - 1))
     return looped_audio[:target_length]
 
+def loop_blocks(read, n_source, n_frames, block_size=RESAMPLE_BLOCK):
+    # Yields n_frames frames block by block, reading the source again from its first frame
+    # whenever it runs out, so looping never materializes the repeated audio
+    if n_source < 1:
+        raise wave.Error("carrier has no audio frames")
+    position = 0
+    while position < n_frames:
+        offset = position % n_source
+        block = read(offset, min(block_size, n_frames - position, n_source - offset))
+        if not len(block):
+            raise wave.Error("carrier ended early")
+        position += len(block)
+        yield block
+
 def is_valid_wav(file_path):
-    try:
-        with wave.open(file_path, 'rb'):
-            return True
-    except (wave.Error, EOFError, IOError):
-        return False
+    return probe_wav(file_path) is not None
+
+def file_digest(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class CarrierCache:
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, file_path, sample_rate=None):
+        file_path = os.path.abspath(file_path)
+        stat = os.stat(file_path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._entries.get(file_path)
+            if entry is None or entry["stamp"] != stamp:
+                digest = file_digest(file_path)
+                if entry is None or entry["digest"] != digest:
+                    entry = {"digest": digest, "variants": {}}
+                    self._entries[file_path] = entry
+                entry["stamp"] = stamp
+
+            if sample_rate not in entry["variants"]:
+                entry["variants"][sample_rate] = self._normalize(file_path, sample_rate)
+            return entry["variants"][sample_rate]
+
+    def preload(self, file_paths, sample_rate=None):
+        for file_path in file_paths:
+            if os.path.exists(file_path):
+                self.get(file_path, sample_rate)
+
+    def _normalize(self, file_path, sample_rate):
+        original_rate, data, sampwidth = load_wave(file_path, return_sampwidth=True)
+        if sample_rate and (original_rate != sample_rate or sampwidth != 2):
+            data = resample_audio(data, original_rate, sample_rate, sampwidth)
+            original_rate, sampwidth = sample_rate, 2
+        # Shared between jobs, so callers must copy before writing
+        data.flags.writeable = False
+        return original_rate, data, sampwidth
+
+carrier_cache = CarrierCache()
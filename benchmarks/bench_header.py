@@ -0,0 +1,90 @@
+import argparse
+import io
+import random
+import struct
+import sys
+import time
+import wave
+
+import numpy as np
+
+from audio.processing import probe_wav, save_wave
+from tests.factories import extensible_wav
+
+def valid_wav(frames=2048, sample_rate=44100):
+    rng = np.random.default_rng(0)
+    output = io.BytesIO()
+    save_wave(output, sample_rate, rng.integers(-8000, 8000, size=(frames, 2), dtype=np.int16))
+    return output.getvalue()
+
+def corpus():
+    return [valid_wav(), extensible_wav(), extensible_wav(sample_rate=48000, channels=2, sampwidth=4)]
+
+def mutate(data, rng):
+    data = bytearray(data)
+    kind = rng.randrange(6)
+    if kind == 0:
+        # Flip random bits in the first 64 bytes, where the RIFF and fmt fields live
+        for _ in range(rng.randint(1, 8)):
+            data[rng.randrange(64)] ^= 1 << rng.randrange(8)
+    elif kind == 1:
+        del data[rng.randrange(64):]
+    elif kind == 2:
+        # Bogus chunk size on the fmt or data chunk
+        struct.pack_into('<I', data, rng.choice([16, 40]), rng.choice([0, 1, 7, 0xFFFFFFFF, rng.getrandbits(32)]))
+    elif kind == 3:
+        struct.pack_into('<H', data, rng.choice([20, 22, 32, 34]), rng.getrandbits(16))
+    elif kind == 4:
+        data[12:16] = rng.choice([b'LIST', b'JUNK', b'data', b'\0\0\0\0'])
+    else:
+        data[:rng.randint(12, 64)] = rng.randbytes(rng.randint(12, 64))
+    return bytes(data)
+
+def wave_open(data):
+    # wave raises RuntimeError, struct.error and others on some malformed headers, not just wave.Error
+    try:
+        with wave.open(io.BytesIO(data)) as wav_file:
+            wav_file.getnframes()
+        return True
+    except Exception:
+        return False
+
+def run(cases, seed):
+    rng = random.Random(seed)
+    carriers = corpus()
+    samples = [mutate(rng.choice(carriers), rng) for _ in range(cases)]
+
+    crashes = 0
+    for carrier in carriers:
+        if probe_wav(carrier) is None:
+            crashes += 1
+            print(f"probe_wav rejected a valid header {carrier[:48].hex()}", file=sys.stderr)
+    slowest = 0.0
+    started = time.perf_counter()
+    for data in samples:
+        begin = time.perf_counter()
+        try:
+            probe_wav(data)
+        except Exception as e:
+            crashes += 1
+            print(f"probe_wav raised {type(e).__name__}: {e} for header {data[:48].hex()}", file=sys.stderr)
+        slowest = max(slowest, time.perf_counter() - begin)
+    probe_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for data in samples:
+        wave_open(data)
+    wave_time = time.perf_counter() - started
+
+    accepted = sum(probe_wav(data) is not None for data in samples)
+    print(f"{cases} fuzzed headers, {accepted} still valid, {crashes} unexpected exceptions")
+    print(f"probe_wav: {probe_time / cases * 1e6:.1f} us/file (slowest {slowest * 1e6:.0f} us)")
+    print(f"wave.open: {wave_time / cases * 1e6:.1f} us/file")
+    return crashes
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fuzz the WAV header parser and time how fast it rejects bad files")
+    parser.add_argument("--cases", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    sys.exit(1 if run(args.cases, args.seed) else 0)
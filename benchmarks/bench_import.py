@@ -0,0 +1,50 @@
+import argparse
+import re
+import subprocess
+import sys
+
+# Budgets in milliseconds, generous enough for slow machines but far below what scipy or discord would add
+BUDGETS = {
+    "audio.processing": 300,
+    "steganography.lsb": 300,
+    "steganography.batch": 350,
+    "bot.jobs": 350,
+}
+# Modules that must stay out of worker processes and the batch CLI
+FORBIDDEN = ("scipy", "discord", "dotenv", "aiohttp")
+
+def import_time(module, repeat):
+    best = None
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            capture_output=True, text=True, check=True
+        )
+        for line in result.stderr.splitlines():
+            match = re.match(r"import time:\s+\d+ \|\s+(\d+) \| (\S+)$", line)
+            if match and match.group(2) == module:
+                cumulative = int(match.group(1)) / 1000
+                best = cumulative if best is None else min(best, cumulative)
+    return best
+
+def imported_forbidden(module):
+    check = f"import sys, {module}; print(' '.join(m for m in {FORBIDDEN!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", check], capture_output=True, text=True, check=True)
+    return result.stdout.split()
+
+def run(repeat):
+    failures = 0
+    print(f"{'module':<22} {'ms':>8} {'budget':>8}  heavy imports")
+    for module, budget in BUDGETS.items():
+        elapsed = import_time(module, repeat)
+        heavy = imported_forbidden(module)
+        failed = elapsed > budget or heavy
+        failures += bool(failed)
+        print(f"{module:<22} {elapsed:>8.1f} {budget:>8}  {', '.join(heavy) or '-'}{'  FAIL' if failed else ''}")
+    return failures
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Guard library import times with python -X importtime")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    sys.exit(1 if run(args.repeat) else 0)
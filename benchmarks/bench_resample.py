@@ -0,0 +1,56 @@
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from audio.processing import load_wave, resample_audio, resample_file, save_wave
+from benchmarks import legacy
+
+def measure(func):
+    tracemalloc.start()
+    started = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / (1024 * 1024)
+
+def run(minutes, source_rate, target_rate):
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "source.wav")
+        output = os.path.join(tmp, "output.wav")
+
+        print(f"{'min':>4} {'implementation':<22} {'seconds':>8} {'peak MB':>8}")
+        for length in minutes:
+            data = rng.integers(-8000, 8000, size=(length * 60 * source_rate, 2), dtype=np.int16)
+            save_wave(source, source_rate, data)
+            del data
+
+            def fft_resample():
+                sample_rate, audio_data = load_wave(source)
+                save_wave(output, target_rate, legacy.resample_audio(audio_data, sample_rate, target_rate))
+
+            def polyphase_array():
+                sample_rate, audio_data = load_wave(source)
+                save_wave(output, target_rate, resample_audio(audio_data, sample_rate, target_rate))
+
+            def polyphase_stream():
+                resample_file(source, output, target_rate)
+
+            for name, func in [("fft (scipy.resample)", fft_resample),
+                               ("polyphase, in memory", polyphase_array),
+                               ("polyphase, streamed", polyphase_stream)]:
+                elapsed, peak = measure(func)
+                print(f"{length:>4} {name:<22} {elapsed:>8.2f} {peak:>8.1f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare FFT and streaming polyphase resampling")
+    parser.add_argument("--minutes", type=int, nargs="+", default=[1, 5, 10])
+    parser.add_argument("--source-rate", type=int, default=48000)
+    parser.add_argument("--target-rate", type=int, default=44100)
+    args = parser.parse_args()
+    run(args.minutes, args.source_rate, args.target_rate)
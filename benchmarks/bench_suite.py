@@ -0,0 +1,134 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from audio.processing import load_wave, loop_audio, resample_audio, save_wave
+from steganography.lsb import (
+    audio_to_text, build_body, bytes_to_bits, embed_bits, text_to_audio, verify_audio_signature
+)
+
+SIGNATURE = "1010110011110000"
+# The largest payload /encrypt accepts: 1000 characters, a 64-character password and 15 exceptions
+PAYLOADS = {
+    "small": ("hello", None, None),
+    "max": (("secret ✦ " * 100)[:1000], "p" * 64, [str(10**18 + i) for i in range(15)]),
+}
+PROFILES = {
+    "quick": {"channels": [1, 2], "rates": [8000, 44100], "seconds": [10, 60]},
+    "full": {"channels": [1, 2], "rates": [8000, 22050, 44100, 48000, 96000], "seconds": [10, 60, 600]},
+}
+
+def measure(func, repeat):
+    # Timing and memory are measured in separate runs because tracemalloc slows allocations down
+    gc.collect()
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+    gc.collect()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": min(times), "peak_mb": peak / (1024 * 1024)}
+
+def make_carrier(path, channels, sample_rate, seconds):
+    rng = np.random.default_rng(0)
+    shape = (seconds * sample_rate, channels) if channels > 1 else (seconds * sample_rate,)
+    save_wave(path, sample_rate, rng.integers(-8000, 8000, size=shape, dtype=np.int16))
+
+def cases(carrier, encoded):
+    sample_rate, data = load_wave(carrier)
+    target_rate = 48000 if sample_rate == 44100 else 44100
+    left = data[:, 0] if data.ndim > 1 else data
+    output = carrier + ".out.wav"
+
+    yield "load_wave", None, lambda: load_wave(carrier)
+    yield "save_wave", None, lambda: save_wave(output, sample_rate, data)
+    yield "resample_audio", None, lambda: resample_audio(data, sample_rate, target_rate)
+    yield "loop_audio", None, lambda: loop_audio(data, len(data) * 2 + 1)
+    for payload, (text, password, exceptions) in PAYLOADS.items():
+        bits = bytes_to_bits(build_body(password, exceptions, text))
+        text_to_audio(text, carrier, encoded, SIGNATURE, password=password, exceptions=exceptions)
+        # Short carriers are looped to fit the payload, as the encoder does
+        channel = left if len(left) >= len(bits) else loop_audio(left, len(bits))
+        yield "embed_bits", payload, lambda bits=bits, channel=channel: embed_bits(channel, bits)
+        yield "text_to_audio", payload, lambda text=text, password=password, exceptions=exceptions: text_to_audio(
+            text, carrier, output, SIGNATURE, password=password, exceptions=exceptions)
+        yield "verify_audio_signature", payload, lambda: verify_audio_signature(encoded, SIGNATURE)
+        yield "audio_to_text", payload, lambda: audio_to_text(encoded, SIGNATURE)
+
+def run(profile, repeat, only=None):
+    matrix = PROFILES[profile]
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        carrier = os.path.join(tmp, "carrier.wav")
+        encoded = os.path.join(tmp, "encoded.wav")
+        print(f"{'case':<52} {'ms':>10} {'peak MB':>8}")
+        for channels in matrix["channels"]:
+            for sample_rate in matrix["rates"]:
+                for seconds in matrix["seconds"]:
+                    make_carrier(carrier, channels, sample_rate, seconds)
+                    for name, payload, func in cases(carrier, encoded):
+                        if only and name not in only:
+                            continue
+                        key = f"{name}/{channels}ch/{sample_rate}Hz/{seconds}s" + (f"/{payload}" if payload else "")
+                        results[key] = measure(func, repeat)
+                        print(f"{key:<52} {results[key]['seconds'] * 1000:>10.2f} {results[key]['peak_mb']:>8.1f}")
+    return results
+
+def compare(results, baseline, threshold, min_seconds):
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        # Very short cases are dominated by timer noise, so only their memory is compared
+        if result["seconds"] > max(base["seconds"], min_seconds) * (1 + threshold):
+            regressions.append(f"{key}: {base['seconds'] * 1000:.2f} ms -> {result['seconds'] * 1000:.2f} ms")
+        if result["peak_mb"] > max(base["peak_mb"], 1) * (1 + threshold):
+            regressions.append(f"{key}: {base['peak_mb']:.1f} MB -> {result['peak_mb']:.1f} MB")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the audio and steganography hot paths on synthetic WAVs")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="quick")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", nargs="+", help="Run only these functions")
+    parser.add_argument("--baseline", help="JSON baseline to compare against")
+    parser.add_argument("--save", help="Write the results as a new JSON baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed slowdown or memory growth (0.25 = 25%%)")
+    parser.add_argument("--min-ms", type=float, default=5, help="Cases faster than this are not checked for time")
+    args = parser.parse_args(argv)
+
+    results = run(args.profile, args.repeat, args.only)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as baseline_file:
+            json.dump({
+                "profile": args.profile,
+                "python": sys.version.split()[0],
+                "numpy": np.__version__,
+                "machine": platform.machine(),
+                "results": results,
+            }, baseline_file, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)["results"]
+        regressions = compare(results, baseline, args.threshold, args.min_ms / 1000)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# Reference implementations from before the hot paths were optimized, kept for comparison
+import numpy as np
+from scipy.signal import resample
+from audio.processing import load_wave, save_wave, loop_audio
+
+def text_to_binary(text):
+    utf8_bytes = text.encode('utf-8')
+    bits = [f"{byte:08b}" for byte in utf8_bytes]
+    return ''.join(bits)
+
+def binary_to_text(binary):
+    bytes_list = [int(binary[i:i+8], 2) for i in range(0, len(binary), 8)]
+    return bytes(bytes_list).decode('utf-8', errors='replace')
+
+def bits_to_array(bits_str, dtype=np.int16):
+    return np.array([int(bit) for bit in bits_str], dtype=dtype)
+
+def extract_bits(audio_channel, num_bits):
+    return (audio_channel[:num_bits] & 1).astype(np.uint8)
+
+def text_to_audio(input_text, song_file, output_file, signature, password=None, exceptions=None):
+    pass_bin = text_to_binary(password or "") if password else ""
+    except_bin = text_to_binary(','.join(exceptions or []))
+    text_bin = text_to_binary(input_text)
+    metadata = (
+        signature +
+        f"{len(pass_bin):016b}" +
+        f"{len(except_bin):016b}" +
+        f"{len(text_bin):016b}" +
+        pass_bin +
+        except_bin +
+        text_bin
+    )
+
+    sample_rate, audio_data = load_wave(song_file)
+    if len(audio_data.shape) == 1:
+        audio_data = np.column_stack((audio_data, audio_data))
+    elif audio_data.shape[1] == 1:
+        audio_data = np.column_stack((audio_data.flatten(), audio_data.flatten()))
+    if len(metadata) > len(audio_data):
+        audio_data = loop_audio(audio_data, len(metadata))
+
+    left_channel = audio_data[:, 0].copy()
+    bits_array = bits_to_array(metadata)
+    left_channel[:len(bits_array)] = (left_channel[:len(bits_array)] & ~1) | bits_array
+    audio_data[:, 0] = left_channel
+    save_wave(output_file, sample_rate, audio_data)
+    return output_file
+
+def audio_to_text(input_file, signature):
+    _, audio_data = load_wave(input_file)
+    left_channel = audio_data[:, 0] if audio_data.ndim > 1 else audio_data
+
+    ptr = len(signature)
+    pass_len = int(''.join(map(str, extract_bits(left_channel[ptr:ptr+16], 16))), 2)
+    ptr += 16
+    except_len = int(''.join(map(str, extract_bits(left_channel[ptr:ptr+16], 16))), 2)
+    ptr += 16
+    text_len = int(''.join(map(str, extract_bits(left_channel[ptr:ptr+16], 16))), 2)
+    ptr += 16
+
+    pass_bits = ''.join(map(str, extract_bits(left_channel[ptr:ptr+pass_len], pass_len)))
+    ptr += pass_len
+    except_bits = ''.join(map(str, extract_bits(left_channel[ptr:ptr+except_len], except_len)))
+    ptr += except_len
+    text_bits = ''.join(map(str, extract_bits(left_channel[ptr:ptr+text_len], text_len)))
+
+    password = binary_to_text(pass_bits) if pass_len else None
+    exceptions = binary_to_text(except_bits) if except_len else None
+    text = binary_to_text(text_bits)
+    return {"password": password, "exceptions": exceptions, "text": text}
+
+def resample_audio(audio_data, original_rate, target_rate):
+    float_data = audio_data.astype(np.float32) / 32768.0
+    num_samples = int(audio_data.shape[0] * (target_rate / original_rate))
+    resampled_float = resample(float_data, num_samples, axis=0)
+    return np.clip(resampled_float * 32768, -32768, 32767).astype(np.int16)
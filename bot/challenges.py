@@ -0,0 +1,47 @@
+import time
+from collections import OrderedDict, namedtuple
+
+Challenge = namedtuple("Challenge", "password_hash text channel followup")
+
+class ChallengeRegistry:
+    def __init__(self, ttl=60, max_pending=10000, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_pending = max_pending
+        self.clock = clock
+        # Every entry has the same TTL, so insertion order is also expiry order
+        self._pending = OrderedDict()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, key, challenge):
+        # A new prompt replaces the user's previous one, and a full registry drops its oldest prompts.
+        # Returns the (key, challenge) pairs displaced either way, so their users can be told
+        displaced = []
+        previous = self._pending.pop(key, None)
+        if previous:
+            displaced.append((key, previous[1]))
+        self._pending[key] = (self.clock() + self.ttl, challenge)
+        while len(self._pending) > self.max_pending:
+            dropped_key, (_, dropped) = self._pending.popitem(last=False)
+            displaced.append((dropped_key, dropped))
+        return displaced
+
+    def pop(self, key):
+        entry = self._pending.get(key)
+        # Expired entries stay in place so expire() can still report them
+        if entry is None or entry[0] < self.clock():
+            return None
+        del self._pending[key]
+        return entry[1]
+
+    def expire(self):
+        now = self.clock()
+        expired = []
+        while self._pending:
+            key, (expires, challenge) = next(iter(self._pending.items()))
+            if expires >= now:
+                break
+            del self._pending[key]
+            expired.append((key, challenge))
+        return expired
@@ -1,26 +1,96 @@
+import contextlib
+import io
+import math
 import os
+import aiohttp
 import discord
 from discord import app_commands
 import asyncio
-from dotenv import load_dotenv
-
-from audio.processing import is_valid_wav, resample_audio_inplace
-from steganography.lsb import (
-    text_to_audio,
-    verify_audio_signature,
-    audio_to_text,
-    generate_random_filename
-)
 
-load_dotenv()
-token = os.getenv("TOKEN")
-signature = os.getenv("SIGNATURE")
-updatesCH = int(os.getenv("UPDATES"))
+from bot.cache import DecryptCache, check_password
+from bot.challenges import Challenge, ChallengeRegistry
+from bot.fetch import fetch_payload
+from bot.jobs import JobExecutor, QueueFullError, encrypt_job, decrypt_job, preload_carriers
+from bot.limits import FairScheduler, RateLimiter, job_cost, scan_cost
+from bot.metrics import metrics
+from bot.scan import ScanIndex, ScanInterrupted, scan_channel
+from bot.settings import load_settings
+from bot.workqueue import QueueExecutor
+from steganography.lsb import generate_random_filename
+
+# Configured by run_bot(); importing this module reads no environment variables
+settings = None
+executor = None
+decrypt_cache = None
+rate_limiter = None
+scheduler = None
+challenges = None
+scan_index = None
+# Shared by every scan, so concurrent scans in different channels do not multiply the downloads
+scan_downloads = None
+background_tasks = []
+# Channels with a scan in progress, so a second /scan does not walk the same messages concurrently
+active_scans = set()
+
+# Deferred jobs expected to start later than this get an ETA reply
+ETA_NOTICE = 3
 
 intents = discord.Intents.default()
-client = discord.Client(intents=intents)
+# Runs every shard in one process unless run_bot() assigns this process a shard range
+client = discord.AutoShardedClient(intents=intents)
 tree = app_commands.CommandTree(client)
 
+def busy_embed():
+    return discord.Embed(
+        title="⏳ Agent Busy",
+        description="The agent is handling too many requests right now. Please try again in a moment.",
+        color=discord.Color.orange()
+    )
+
+def count_error(command, reason):
+    metrics.inc("errors_total", command=command, reason=reason)
+
+def rate_limited_embed(retry_after):
+    return discord.Embed(
+        title="🐢 Slow Down",
+        description=f"You're sending heavy requests too quickly. Please try again in {math.ceil(retry_after)} seconds.",
+        color=discord.Color.orange()
+    )
+
+async def admit(interaction, command, cost):
+    # Applies the per-user, per-guild and global limits, and tells the user when their job is deferred
+    granted, wait = rate_limiter.acquire(interaction.user.id, interaction.guild_id, cost)
+    if not granted:
+        count_error(command, "rate_limited")
+        await interaction.followup.send(embed=rate_limited_embed(wait), ephemeral=True)
+        return False
+    eta = wait + scheduler.estimate(interaction.user.id, cost)
+    if eta >= ETA_NOTICE:
+        metrics.inc("jobs_deferred_total", command=command)
+        await interaction.followup.send(
+            f"⏳ The agent is busy. Your request is queued and should start in about {math.ceil(eta)} seconds.",
+            ephemeral=True
+        )
+    if wait:
+        await asyncio.sleep(wait)
+    return True
+
+def secret_embed(text):
+    embed = discord.Embed(
+        title="🔑 Your Secret Message",
+        description=f"```{text}```",
+        color=discord.Color.green()
+    )
+    embed.set_footer(text="Keep it safe. Secrets like these are precious!")
+    return embed
+
+def timeout_embed():
+    return discord.Embed(
+        title="⏰ Processing Timed Out",
+        description="Your audio took too long to process. Please try again with a shorter file.",
+        color=discord.Color.red()
+    )
+
 @tree.command(
     name="encrypt",
     description="Encrypt a text message"
@@ -29,11 +99,12 @@ tree = app_commands.CommandTree(client)
     input="The text you want to encrypt",
     audio="The audio (.wav file) you want the bot to use",
     password="The password needed for decryption",
-    exceptions="The users who do not require a password for decryption"
+    exceptions="The users who do not require a password for decryption",
+    carrier="A built-in audio to use when no file is uploaded"
 )
 @app_commands.allowed_installs(guilds=True, users=True)
 @discord.app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
-async def encrypt(interaction: discord.Interaction, input: str, password: str = None, exceptions: str = None, audio: discord.Attachment = None):
+async def encrypt(interaction: discord.Interaction, input: str, password: str = None, exceptions: str = None, audio: discord.Attachment = None, carrier: str = None):
     await interaction.response.defer(ephemeral=True)
     if len(input) > 1000:
         embed = discord.Embed(
@@ -41,6 +112,7 @@ async def encrypt(interaction: discord.Interaction, input: str, password: str =
             description="Your message exceeds 1000 characters. Please shorten it and try again.",
             color=discord.Color.red()
         )
+        count_error("encrypt", "message_too_long")
         await interaction.followup.send(embed=embed, ephemeral=True)
         return
     
@@ -50,6 +122,7 @@ async def encrypt(interaction: discord.Interaction, input: str, password: str =
             description="Your password exceeds 64 characters. Please shorten it and try again.",
             color=discord.Color.red()
         )
+        count_error("encrypt", "password_too_long")
         await interaction.followup.send(embed=embed, ephemeral=True)
         return
     
@@ -59,6 +132,7 @@ async def encrypt(interaction: discord.Interaction, input: str, password: str =
             description="The uploaded file exceeds 50MB. Please upload a smaller file and try again.",
             color=discord.Color.red()
         )
+        count_error("encrypt", "file_too_large")
         await interaction.followup.send(embed=embed, ephemeral=True)
         return
     
@@ -68,6 +142,7 @@ async def encrypt(interaction: discord.Interaction, input: str, password: str =
             description="You cannot provide exceptions without setting a password first. Please correct and try again.",
             color=discord.Color.red()
         )
+        count_error("encrypt", "invalid_configuration")
         await interaction.followup.send(embed=embed, ephemeral=True)
         return
     
@@ -90,19 +165,35 @@ async def encrypt(interaction: discord.Interaction, input: str, password: str =
                 description="The number of exceptions cannot exceed 15 users. Please reduce the list and try again.",
                 color=discord.Color.red()
             )
+            count_error("encrypt", "too_many_exceptions")
             await interaction.followup.send(embed=embed, ephemeral=True)
             return
         
     if audio is None:
-        audio_path = "./default.wav"
+        if carrier is not None and carrier not in settings.carriers:
+            available = ", ".join(f"`{name}`" for name in settings.carriers) or "none"
+            embed = discord.Embed(
+                title="🎵 Unknown Carrier",
+                description=(
+                    f"`{carrier}` is not one of the built-in carriers (available: {available}). "
+                    "Please pick one from the suggestions or upload a `.wav` file."
+                ),
+                color=discord.Color.red()
+            )
+            count_error("encrypt", "unknown_carrier")
+            await interaction.followup.send(embed=embed, ephemeral=True)
+            return
+        audio_path = settings.carriers.get(carrier, settings.default_carrier)
         if not os.path.exists(audio_path):
             embed = discord.Embed(
                 title="📁 Default Audio Missing",
                 description="The default audio file is not found. Please upload an audio file to proceed.",
                 color=discord.Color.red()
             )
+            count_error("encrypt", "default_audio_missing")
             await interaction.followup.send(embed=embed, ephemeral=True)
             return
+        audio_source = audio_path
     else:
         if not audio.filename.endswith(".wav"):
             embed = discord.Embed(
@@ -113,17 +204,33 @@ async def encrypt(interaction: discord.Interaction, input: str, password: str =
                 ),
                 color=discord.Color.red()
             )
+            count_error("encrypt", "unsupported_format")
             await interaction.followup.send(embed=embed, ephemeral=True)
             return
 
-        audio_path = f"./{audio.filename}"
-        await audio.save(audio_path)
+    # Uploads are weighted by size, so small default-carrier jobs are not stuck behind huge files
+    cost = job_cost(audio.size if audio else 0)
+    if not await admit(interaction, "encrypt", cost):
+        return
 
     output_filename = generate_random_filename()
-    output_path = f"./{output_filename}"
+    output_data = b""
 
     try:
-        if not is_valid_wav(audio_path):
+        async with scheduler.slot(interaction.user.id, cost):
+            if audio is not None:
+                with metrics.timer("stage_seconds", command="encrypt", stage="download"):
+                    audio_source = await audio.read()
+                metrics.inc("bytes_in_total", len(audio_source), command="encrypt")
+            with metrics.timer("stage_seconds", command="encrypt", stage="job"):
+                job_result = await executor.submit(
+                    encrypt_job, audio_source, input, settings.signature,
+                    password=password, exceptions=mentioned_user_ids, cached=audio is None,
+                    resample_rate=settings.resample_rate, upload_limit=interaction.filesize_limit,
+                    trim=settings.trim_carrier
+                )
+
+        if job_result.get("rejected") == "invalid_audio":
             embed = discord.Embed(
                 title="🚫 Invalid Audio File",
                 description=(
@@ -131,14 +238,12 @@ async def encrypt(interaction: discord.Interaction, input: str, password: str =
                 ),
                 color=discord.Color.red()
             )
+            count_error("encrypt", "invalid_audio")
             await interaction.followup.send(embed=embed, ephemeral=True)
             return
-        
-        await resample_audio_inplace(audio_path)
-        text_to_audio(input, audio_path, output_file=output_path, signature=signature, password=password, exceptions=mentioned_user_ids)
         await interaction.followup.send("🔧 Encrypting your message... Please wait.", ephemeral=True)
 
-        if not is_valid_wav(output_path):
+        if job_result.get("rejected") == "invalid_output":
             embed = discord.Embed(
                 title="An Unexpected Error Occurred with Encrypted Audio",
                 description=(
@@ -147,19 +252,28 @@ async def encrypt(interaction: discord.Interaction, input: str, password: str =
                 ),
                 color=discord.Color.red()
             )
+            count_error("encrypt", "invalid_output")
             await interaction.followup.send(embed=embed, ephemeral=True)
             return
 
-        with open(output_path, 'rb') as file:
-            att_message = f"Musical message from {interaction.user.mention}"
-            if password: att_message = f"Musical message: {interaction.user.mention} → {exceptions}"
-            await interaction.followup.send(att_message, file=discord.File(file, output_filename))
-
+        output_data = job_result["output"]
+        att_message = f"Musical message from {interaction.user.mention}"
+        if password: att_message = f"Musical message: {interaction.user.mention} → {exceptions}"
+        with metrics.timer("stage_seconds", command="encrypt", stage="upload"):
+            await interaction.followup.send(att_message, file=discord.File(io.BytesIO(output_data), output_filename))
+        metrics.inc("bytes_out_total", len(output_data), command="encrypt")
+
+    except QueueFullError:
+        count_error("encrypt", "busy")
+        await interaction.followup.send(embed=busy_embed(), ephemeral=True)
+    except asyncio.TimeoutError:
+        count_error("encrypt", "timeout")
+        await interaction.followup.send(embed=timeout_embed(), ephemeral=True)
     except Exception as e:
         error_message = str(e)
         if "error code: 40005" in error_message or "413 Payload Too Large" in error_message:
-            file_size_bytes = os.path.getsize(output_path) if os.path.exists(output_path) else 0
-            file_size_mb = file_size_bytes / (1024 * 1024)
+            count_error("encrypt", "payload_too_large")
+            file_size_mb = len(output_data) / (1024 * 1024)
             embed = discord.Embed(
                 title="⚠️ File Too Large",
                 description=(
@@ -172,6 +286,7 @@ async def encrypt(interaction: discord.Interaction, input: str, password: str =
             )
             await interaction.followup.send(embed=embed, ephemeral=True)
         else:
+            count_error("encrypt", "unexpected")
             embed = discord.Embed(
                 title="⚠️ An Unexpected Error Occurred",
                 description=f"```{error_message}```",
@@ -179,11 +294,13 @@ async def encrypt(interaction: discord.Interaction, input: str, password: str =
             )
             await interaction.followup.send(embed=embed, ephemeral=True)
 
-    finally:
-        if audio is not None and os.path.exists(audio_path):
-            os.remove(audio_path)
-        if os.path.exists(output_path):
-            os.remove(output_path)
+@encrypt.autocomplete("carrier")
+async def carrier_autocomplete(interaction: discord.Interaction, current: str):
+    return [
+        app_commands.Choice(name=name, value=name)
+        for name in settings.carriers
+        if current.lower() in name.lower()
+    ][:25]
 
 @tree.context_menu(name="decrypt")
 @app_commands.allowed_installs(guilds=True, users=True)
@@ -196,6 +313,7 @@ async def decrypt(interaction: discord.Interaction, message: discord.Message):
             description="This message does not contain any attachments. Please provide a valid `.wav` file to decrypt.",
             color=discord.Color.red()
         )
+        count_error("decrypt", "no_attachments")
         await interaction.followup.send(embed=embed, ephemeral=True)
         return
     attachment = message.attachments[0]
@@ -205,54 +323,70 @@ async def decrypt(interaction: discord.Interaction, message: discord.Message):
             description="This attachment is not a valid `.wav` file. Please ensure the file is in the correct format and try again.",
             color=discord.Color.red()
         )
+        count_error("decrypt", "unsupported_format")
         await interaction.followup.send(embed=embed, ephemeral=True)
         return
     
-    file_path = f"./{attachment.filename}"
-    await attachment.save(file_path)
+    # Attachments are immutable, so their ID and size identify the content
+    cache_key = (attachment.id, attachment.size)
 
     try:
-        if not is_valid_wav(file_path):
+        decryption_result = decrypt_cache.get(cache_key)
+        if decryption_result is None:
+            # Only a prefix of the attachment is downloaded, so every decrypt costs the same
+            if not await admit(interaction, "decrypt", job_cost()):
+                return
+            async with scheduler.slot(interaction.user.id, job_cost()):
+                # Only the WAV header, signature and payload span are downloaded; other files are rejected after a few KB
+                with metrics.timer("stage_seconds", command="decrypt", stage="download"):
+                    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=60)) as session:
+                        fetched = await fetch_payload(session, attachment.url, settings.signature)
+                metrics.inc("bytes_in_total", fetched["bytes_read"], command="decrypt")
+                if "audio" in fetched:
+                    with metrics.timer("stage_seconds", command="decrypt", stage="job"):
+                        decryption_result = await executor.submit(decrypt_job, fetched["audio"], settings.signature)
+                else:
+                    decryption_result = {"rejected": fetched["rejected"]}
+                del fetched
+            decrypt_cache.put(cache_key, decryption_result)
+
+        if decryption_result.get("rejected") == "invalid_audio":
             embed = discord.Embed(
                 title="🚫 Invalid Audio File",
                 description="The provided audio file is invalid or corrupted. Please upload a valid `.wav` file.",
                 color=discord.Color.red()
             )
+            count_error("decrypt", "invalid_audio")
             await interaction.followup.send(embed=embed, ephemeral=True)
             return
         
-        if not verify_audio_signature(file_path, signature=signature):
+        if decryption_result.get("rejected") == "verification_failed":
             embed = discord.Embed(
                 title="🔍 Verification Failed",
                 description="The file is not a valid encrypted audio.",
                 color=discord.Color.red()
             )
+            count_error("decrypt", "verification_failed")
             await interaction.followup.send(embed=embed, ephemeral=True)
             return
 
-        decryption_result = audio_to_text(file_path, signature=signature)
         if "error" in decryption_result:
                 embed = discord.Embed(
                     title="⚠️ Decryption Failed",
                     description=decryption_result["error"],
                     color=discord.Color.red()
                 )
+                count_error("decrypt", "decryption_failed")
                 await interaction.followup.send(embed=embed, ephemeral=True)
                 return
         
-        extracted_password = decryption_result.get("password")
+        password_hash = decryption_result.get("password_hash")
         exceptions = decryption_result.get("exceptions")
         exceptions_list = exceptions.split(",") if exceptions else []
         extracted_text = decryption_result.get("text")
+        embed = secret_embed(extracted_text)
 
-        embed = discord.Embed(
-            title="🔑 Your Secret Message",
-            description=f"```{extracted_text}```",
-            color=discord.Color.green()
-        )
-        embed.set_footer(text="Keep it safe. Secrets like these are precious!")
-
-        if not extracted_password:
+        if not password_hash:
             await interaction.followup.send(embed=embed, ephemeral=True)
             return
 
@@ -263,31 +397,38 @@ async def decrypt(interaction: discord.Interaction, message: discord.Message):
 
         await interaction.followup.send("🔑 Password required. Check your DMs.", ephemeral=True)
         try:
-            user = interaction.user
-            try:
-                dm_channel = await user.create_dm()
-                await dm_channel.send("🔑 Please enter the decryption password:")
-            except discord.Forbidden:
-                await interaction.followup.send("❌ Unable to send you a DM. Please enable DMs from server members and try again.", ephemeral=True)
-                return
-            except Exception as e:
-                await interaction.followup.send("❌ An error occurred while trying to send you a DM. Please try again later.", ephemeral=True)
-                return
-
-            def check(msg):
-                return msg.author == user and msg.channel == dm_channel and len(msg.content) > 0
+            dm_channel = await interaction.user.create_dm()
+            await dm_channel.send("🔑 Please enter the decryption password:")
+        except discord.Forbidden:
+            await interaction.followup.send("❌ Unable to send you a DM. Please enable DMs from server members and try again.", ephemeral=True)
+            return
+        except Exception as e:
+            await interaction.followup.send("❌ An error occurred while trying to send you a DM. Please try again later.", ephemeral=True)
+            return
 
-            password_message = await interaction.client.wait_for("message", check=check, timeout=60)
-            if password_message.content == extracted_password:
-                await dm_channel.send(f"✅ Password correct! The secret has been sent to {interaction.channel.mention}.")
-                await interaction.followup.send(embed=embed, ephemeral=True)
+        # Only the salted hash and the decoded text wait for the reply, which on_message resolves
+        displaced = challenges.add(interaction.user.id, Challenge(
+            password_hash, extracted_text, getattr(interaction.channel, "mention", "this conversation"), interaction.followup
+        ))
+        for user_id, challenge in displaced:
+            if user_id == interaction.user.id:
+                count_error("decrypt", "password_replaced")
+                with contextlib.suppress(discord.HTTPException):
+                    await challenge.followup.send(
+                        "🔁 A newer decrypt request replaced this password prompt. Decryption process aborted.",
+                        ephemeral=True
+                    )
             else:
-                await dm_channel.send("❌ Wrong password. Decryption failed.")
-
-        except asyncio.TimeoutError:
-            await user.send("⏰ You took too long to respond. Decryption process aborted.")
-            return
+                count_error("decrypt", "password_overflow")
+                await abort_challenge(user_id, "⏳ Too many password prompts are pending. Decryption process aborted.")
+    except QueueFullError:
+        count_error("decrypt", "busy")
+        await interaction.followup.send(embed=busy_embed(), ephemeral=True)
+    except asyncio.TimeoutError:
+        count_error("decrypt", "timeout")
+        await interaction.followup.send(embed=timeout_embed(), ephemeral=True)
     except Exception as e:
+        count_error("decrypt", "unexpected")
         embed = discord.Embed(
             title="⚠️ An Unexpected Error Occurred",
             description=f"```{e}```",
@@ -295,9 +436,96 @@ async def decrypt(interaction: discord.Interaction, message: discord.Message):
         )
         await interaction.followup.send(embed=embed, ephemeral=True)
 
+@tree.command(
+    name="scan",
+    description="Find the messages in this channel that carry hidden messages"
+)
+@app_commands.allowed_installs(guilds=True, users=True)
+@discord.app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
+async def scan(interaction: discord.Interaction):
+    await interaction.response.defer(ephemeral=True)
+    channel = interaction.channel
+    if channel.id in active_scans:
+        embed = discord.Embed(
+            title="⏳ Scan In Progress",
+            description="This channel is already being scanned. Please try again when it finishes.",
+            color=discord.Color.orange()
+        )
+        count_error("scan", "in_progress")
+        await interaction.followup.send(embed=embed, ephemeral=True)
+        return
+
+    # Registered before anything is awaited, so a second /scan in this channel cannot slip past the check
+    active_scans.add(channel.id)
+
+    @contextlib.asynccontextmanager
+    async def page_slot(attachments):
+        # Every page is charged by the attachments it downloads and runs under the fair scheduler; a
+        # scan that would wait too long stops and keeps the pages indexed so far
+        cost = scan_cost(attachments)
+        granted, wait = rate_limiter.acquire(interaction.user.id, interaction.guild_id, cost)
+        if not granted:
+            count_error("scan", "rate_limited")
+            raise ScanInterrupted(wait)
+        if wait:
+            await asyncio.sleep(wait)
+        async with scheduler.slot(interaction.user.id, cost):
+            yield
+
+    try:
+        with metrics.timer("stage_seconds", command="scan", stage="scan"):
+            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=60)) as session:
+                stats = await scan_channel(
+                    channel, session, settings.signature, scan_index,
+                    limit=settings.scan_limit, semaphore=scan_downloads, slot=page_slot
+                )
+        found = await asyncio.to_thread(scan_index.payloads, channel.id, 10)
+    except QueueFullError:
+        count_error("scan", "busy")
+        await interaction.followup.send(embed=busy_embed(), ephemeral=True)
+        return
+    except discord.Forbidden:
+        embed = discord.Embed(
+            title="🚫 Missing Access",
+            description="The agent cannot read this channel's history. Please check its permissions and try again.",
+            color=discord.Color.red()
+        )
+        count_error("scan", "forbidden")
+        await interaction.followup.send(embed=embed, ephemeral=True)
+        return
+    except Exception as e:
+        count_error("scan", "unexpected")
+        embed = discord.Embed(
+            title="⚠️ An Unexpected Error Occurred",
+            description=f"```{e}```",
+            color=discord.Color.red()
+        )
+        await interaction.followup.send(embed=embed, ephemeral=True)
+        return
     finally:
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        active_scans.discard(channel.id)
+
+    guild = interaction.guild_id or "@me"
+    lines = [
+        f"• [Message](https://discord.com/channels/{guild}/{channel.id}/{message_id}) — "
+        f"{'🔒 password' if password else '🔓 open'}, {size} bytes"
+        for message_id, _, _, size, password in found
+    ]
+    description = (
+        f"Checked **{stats['messages']}** new messages and **{stats['attachments']}** new `.wav` files; "
+        f"**{stats['payloads']}** carry hidden messages.\n\n"
+    )
+    description += "\n".join(lines) if lines else "No hidden messages have been found in this channel yet."
+    if stats["retry_after"] is not None:
+        description += (
+            f"\n\nThe scan was paused to stay within the rate limits. "
+            f"Run `/scan` again in {math.ceil(stats['retry_after'])} seconds to continue."
+        )
+    elif not stats["complete"]:
+        description += "\n\nThere are more messages to check. Run `/scan` again to continue."
+    embed = discord.Embed(title="🔎 Scan Complete", description=description, color=discord.Color.green())
+    embed.set_footer(text="Most recent hidden messages first. Use the Decrypt command to read them.")
+    await interaction.followup.send(embed=embed, ephemeral=True)
 
 @tree.command(
     name="help",
@@ -359,6 +587,18 @@ async def help(interaction: discord.Interaction):
 
     embed.add_field(name="\u200b", value="✦・―――――――・✦", inline=False)
 
+    embed.add_field(
+        name="🔎 `/scan` Command",
+        value=(
+            "**Mission:** Locate every concealed message in the current channel.\n\n"
+            "Checks the `.wav` files posted since the last scan and lists the messages that carry secrets, "
+            "noting which ones are password protected."
+        ),
+        inline=False
+    )
+
+    embed.add_field(name="\u200b", value="✦・―――――――・✦", inline=False)
+
     embed.add_field(
         name="⚠️ Security Advisory",
         value=(
@@ -374,14 +614,50 @@ async def help(interaction: discord.Interaction):
 
     await interaction.response.send_message(embed=embed)
 
+@client.event
+async def on_message(message):
+    # Password replies arrive as DMs; one dictionary lookup replaces a wait_for check per pending prompt
+    if message.guild is not None or message.author.bot or not message.content:
+        return
+    challenge = challenges.pop(message.author.id)
+    if challenge is None:
+        return
+    if await asyncio.to_thread(check_password, message.content, challenge.password_hash):
+        await message.channel.send(f"✅ Password correct! The secret has been sent to {challenge.channel}.")
+        await challenge.followup.send(embed=secret_embed(challenge.text), ephemeral=True)
+    else:
+        count_error("decrypt", "wrong_password")
+        await message.channel.send("❌ Wrong password. Decryption failed.")
+
+async def abort_challenge(user_id, reason):
+    with contextlib.suppress(discord.HTTPException):
+        user = client.get_user(user_id) or await client.fetch_user(user_id)
+        await user.send(reason)
+
+async def expire_challenges(interval=5):
+    while True:
+        await asyncio.sleep(interval)
+        for user_id, _ in challenges.expire():
+            count_error("decrypt", "password_timeout")
+            await abort_challenge(user_id, "⏰ You took too long to respond. Decryption process aborted.")
+
 @client.event
 async def on_ready():
-    await tree.sync()
+    # Commands are global, so only the process hosting shard 0 syncs them
+    if client.shard_ids is None or 0 in client.shard_ids:
+        await tree.sync()
+    # on_ready fires again after reconnects, so background tasks are only started once
+    if not background_tasks:
+        background_tasks.append(asyncio.create_task(expire_challenges()))
+        if settings.metrics_port:
+            background_tasks.append(await metrics.serve(settings.metrics_host, settings.metrics_port))
+        if settings.metrics_interval:
+            background_tasks.append(asyncio.create_task(metrics.dump_every(settings.metrics_interval)))
     print("Logged in and Ready!")
 
 @client.event
 async def on_guild_join(guild):
-    log_channel = client.get_channel(updatesCH)
+    log_channel = client.get_channel(settings.updates_channel)
     if log_channel:
         ownerID = guild.owner_id
         owner = await client.fetch_user(ownerID)
@@ -401,7 +677,7 @@ async def on_guild_join(guild):
 
 @client.event
 async def on_guild_remove(guild):
-    log_channel = client.get_channel(updatesCH)
+    log_channel = client.get_channel(settings.updates_channel)
     if log_channel:
         ownerID = guild.owner_id
         owner = await client.fetch_user(ownerID)
@@ -420,4 +696,47 @@ async def on_guild_remove(guild):
         await log_channel.send(embed=embed)
 
 def run_bot():
-    client.run(token)
+    global settings, executor, decrypt_cache, rate_limiter, scheduler, challenges, scan_index, scan_downloads
+    settings = load_settings()
+    client.shard_count = settings.shard_count
+    client.shard_ids = settings.shard_ids
+    if settings.work_queue:
+        # Jobs are run by separate `python -m bot.worker` processes shared by every gateway process
+        executor = QueueExecutor(settings.work_queue, max_queue=settings.job_queue, timeout=settings.job_timeout)
+    else:
+        executor = JobExecutor(
+            workers=settings.workers,
+            mode=settings.worker_mode,
+            max_queue=settings.job_queue,
+            timeout=settings.job_timeout,
+            initializer=preload_carriers,
+            initargs=([settings.default_carrier, *settings.carriers.values()], settings.resample_rate)
+        )
+    rate_limiter = RateLimiter(
+        user=settings.rate_user,
+        guild=settings.rate_guild,
+        total=settings.rate_global,
+        max_wait=settings.rate_max_wait
+    )
+    slots = settings.workers or os.cpu_count() or 1
+    scheduler = FairScheduler(slots, max_waiting=settings.job_queue or slots * 4)
+    challenges = ChallengeRegistry(ttl=60)
+    scan_index = ScanIndex(settings.scan_index)
+    scan_downloads = asyncio.Semaphore(settings.scan_concurrency)
+    decrypt_cache = DecryptCache(
+        max_entries=settings.decrypt_cache_size,
+        max_bytes=settings.decrypt_cache_bytes,
+        ttl=settings.decrypt_cache_ttl
+    )
+    metrics.gauge("job_queue_depth", lambda: executor.pending)
+    metrics.gauge("job_queue_limit", lambda: executor.max_queue)
+    metrics.gauge("scheduler_running", lambda: scheduler.running)
+    metrics.gauge("scheduler_waiting", lambda: scheduler.waiting)
+    metrics.gauge("password_prompts_pending", lambda: len(challenges))
+    for name in ("entries", "bytes", "hits", "misses", "evictions"):
+        metrics.gauge(f"decrypt_cache_{name}", lambda name=name: decrypt_cache.stats()[name])
+    try:
+        client.run(settings.token)
+    finally:
+        executor.shutdown()
+        scan_index.close()
@@ -0,0 +1,80 @@
+import wave
+
+from audio.processing import HEADER_PREFIX, MAX_HEADER_SIZE, build_wave, parse_wav_header
+from steganography.lsb import FORMAT_HEADER_BITS, payload_frames, verify_audio_signature
+
+class AttachmentStream:
+    def __init__(self, session, url):
+        self.session = session
+        self.url = url
+        self.bytes_read = 0
+        self._response = None
+        self._buffer = bytearray()
+
+    async def read(self, offset, size):
+        if size <= 0:
+            return b""
+        if self._response is None:
+            headers = {"Range": f"bytes={offset}-{offset + size - 1}"}
+            response = await self.session.get(self.url, headers=headers)
+            if response.status in (206, 416):
+                data = await response.read() if response.status == 206 else b""
+                response.release()
+                self.bytes_read += len(data)
+                return data
+            try:
+                response.raise_for_status()
+            except Exception:
+                response.release()
+                raise
+            # The server ignored the Range header, so keep its body open and read it incrementally
+            self._response = response
+
+        while len(self._buffer) < offset + size:
+            chunk = await self._response.content.read(offset + size - len(self._buffer))
+            if not chunk:
+                break
+            self._buffer += chunk
+            self.bytes_read += len(chunk)
+        return bytes(self._buffer[offset:offset + size])
+
+    async def close(self):
+        if self._response is not None:
+            self._response.close()
+            self._response = None
+
+async def fetch_payload(session, url, signature, prefix_only=False):
+    stream = AttachmentStream(session, url)
+    try:
+        header = await stream.read(0, HEADER_PREFIX)
+        try:
+            info = parse_wav_header(header)
+            while info is None and len(header) < MAX_HEADER_SIZE:
+                more = await stream.read(len(header), len(header))
+                if not more:
+                    break
+                header += more
+                info = parse_wav_header(header)
+        except wave.Error:
+            info = None
+        if info is None:
+            return {"rejected": "invalid_audio", "bytes_read": stream.bytes_read}
+
+        # Enough frames for the signature and every header variant, then exactly the payload span
+        frame_size = info.nchannels * info.sampwidth
+        prefix_frames = min(len(signature) + FORMAT_HEADER_BITS + 48, info.nframes)
+        frames = await stream.read(info.data_offset, prefix_frames * frame_size)
+        audio = build_wave(info, frames)
+        if not verify_audio_signature(audio, signature=signature):
+            return {"rejected": "verification_failed", "bytes_read": stream.bytes_read}
+        if prefix_only:
+            # Enough to size the payload and read its flags, e.g. when indexing a channel
+            return {"audio": audio, "bytes_read": stream.bytes_read}
+
+        required_frames = min(payload_frames(audio, signature) or 0, info.nframes)
+        if required_frames > prefix_frames:
+            frames += await stream.read(info.data_offset + len(frames), (required_frames - prefix_frames) * frame_size)
+            audio = build_wave(info, frames)
+        return {"audio": audio, "bytes_read": stream.bytes_read}
+    finally:
+        await stream.close()
@@ -0,0 +1,185 @@
+import asyncio
+import contextlib
+import io
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from bot.cache import hash_password
+from bot.metrics import StageTimer, metrics, peak_rss, reset_peak_rss
+from audio.processing import carrier_cache, is_valid_wav, probe_wav, resample_audio_inplace
+from steganography.lsb import text_to_audio, verify_audio_signature, audio_to_text
+
+class QueueFullError(Exception):
+    pass
+
+_current_job = threading.local()
+
+def stage(name):
+    timer = getattr(_current_job, "timer", None)
+    return timer.stage(name) if timer else contextlib.nullcontext()
+
+def run_job(func, args, kwargs, reset_rss=True):
+    # Runs in the worker and reports its own stage timings and peak memory alongside the result
+    _current_job.timer = timer = StageTimer()
+    if reset_rss:
+        reset_peak_rss()
+    started = time.perf_counter()
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        _current_job.timer = None
+    stats = {"stages": timer.stages, "seconds": time.perf_counter() - started, "peak_rss": peak_rss()}
+    return result, stats
+
+class JobExecutor:
+    def __init__(self, workers=None, mode="process", max_queue=None, timeout=120, initializer=None, initargs=()):
+        if mode not in ("process", "thread"):
+            raise ValueError(f"Unknown worker mode: {mode}")
+        self.workers = workers or os.cpu_count() or 1
+        self.mode = mode
+        self.max_queue = max_queue or self.workers * 2
+        self.timeout = timeout
+        self.initializer = initializer
+        self.initargs = initargs
+        self.pending = 0
+        self._pool = None
+        # Unfinished jobs per pool, and the ones whose submitter has given up on them
+        self._jobs = {}
+        self._abandoned = set()
+        self._retired = {}
+
+    def _get_pool(self):
+        if self._pool is None:
+            pool_class = ProcessPoolExecutor if self.mode == "process" else ThreadPoolExecutor
+            self._pool = pool_class(max_workers=self.workers, initializer=self.initializer, initargs=self.initargs)
+            self._jobs[self._pool] = set()
+        return self._pool
+
+    def _job_done(self, pool, future):
+        self.pending -= 1
+        self._abandoned.discard(future)
+        jobs = self._jobs[pool]
+        jobs.discard(future)
+        if not jobs and pool is not self._pool:
+            del self._jobs[pool]
+
+    async def submit(self, func, *args, timeout=None, **kwargs):
+        # pending counts both queued and running jobs; it is only touched from the event loop
+        command = func.__name__.removesuffix("_job")
+        if self.pending >= self.max_queue:
+            metrics.inc("jobs_rejected_total", command=command)
+            raise QueueFullError("Job queue is full")
+        loop = asyncio.get_running_loop()
+        pool = self._get_pool()
+        # Threads share one process, so the high-water mark cannot be reset per job there
+        future = pool.submit(run_job, func, args, kwargs, reset_rss=self.mode == "process")
+        self.pending += 1
+        self._jobs[pool].add(future)
+        # A job keeps its place in the queue until it has really stopped, not just until its submitter gave up
+        def done(future):
+            # The loop may already be closed when a job abandoned at shutdown finishes
+            with contextlib.suppress(RuntimeError):
+                loop.call_soon_threadsafe(self._job_done, pool, future)
+        future.add_done_callback(done)
+        try:
+            result, stats = await asyncio.wait_for(asyncio.wrap_future(future), timeout or self.timeout)
+            metrics.record_job(command, stats)
+            return result
+        finally:
+            # Drops the job if it never started; a running job is stopped by retiring its process pool
+            if not future.done() and not future.cancel():
+                self._abandoned.add(future)
+                self._retire(pool)
+
+    def _retire(self, pool):
+        # A running job cannot be cancelled, so new jobs go to a fresh pool and the old pool's processes
+        # are terminated as soon as the jobs still wanted from it have finished. Threads cannot be
+        # stopped, so in thread mode an abandoned job just runs to completion
+        if self.mode != "process" or pool is not self._pool:
+            return
+        self._pool = None
+        self._retired[pool] = asyncio.create_task(self._terminate_when_idle(pool))
+
+    async def _terminate_when_idle(self, pool, poll_interval=0.1):
+        while self._jobs.get(pool, set()) - self._abandoned:
+            await asyncio.sleep(poll_interval)
+        self._terminate(pool)
+
+    def _terminate(self, pool):
+        # ProcessPoolExecutor has no public way to stop a running call; the abandoned futures fail
+        # with BrokenProcessPool, which releases their queue places
+        for process in list(getattr(pool, "_processes", {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+        self._retired.pop(pool, None)
+
+    def shutdown(self):
+        for pool, task in list(self._retired.items()):
+            task.cancel()
+            self._terminate(pool)
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+def preload_carriers(file_paths, sample_rate=None):
+    carrier_cache.preload(file_paths, sample_rate)
+
+def encrypt_job(audio, input_text, signature, password=None, exceptions=None,
+                cached=False, resample_rate=None, upload_limit=None, trim=False):
+    output = io.BytesIO()
+
+    def encode(carrier, trim=trim):
+        with stage("embed"):
+            text_to_audio(input_text, carrier, output_file=output, signature=signature,
+                          password=password, exceptions=exceptions, trim=trim)
+        return not upload_limit or output.seek(0, io.SEEK_END) <= upload_limit
+
+    if cached:
+        # Built-in carriers are decoded (and resampled, if configured) once per worker, then shared read-only
+        with stage("load"):
+            carrier = carrier_cache.get(audio, sample_rate=resample_rate)
+        if not encode(carrier):
+            encode(carrier, trim=True)
+        return {"output": output.getvalue()}
+
+    audio = io.BytesIO(audio)
+    with stage("validate"):
+        if not is_valid_wav(audio):
+            return {"rejected": "invalid_audio"}
+    if resample_rate:
+        with stage("resample"):
+            resample_audio_inplace(audio, resample_rate)
+    # Embedding at the native rate and width is lossless; the carrier is only re-encoded,
+    # and then cut down to the payload, when the result cannot be uploaded
+    fits = encode(audio)
+    if not fits and not resample_rate:
+        with stage("resample"):
+            resample_audio_inplace(audio, 44100)
+        fits = encode(audio)
+    if not fits:
+        encode(audio, trim=True)
+    with stage("validate"):
+        if not is_valid_wav(output):
+            return {"rejected": "invalid_output"}
+    return {"output": output.getvalue()}
+
+def decrypt_job(audio, signature):
+    with stage("validate"):
+        # The header is parsed once and the descriptor reused by every read below
+        info = probe_wav(audio)
+        if info is None:
+            return {"rejected": "invalid_audio"}
+        if not verify_audio_signature(audio, signature, info):
+            return {"rejected": "verification_failed"}
+    with stage("extract"):
+        result = audio_to_text(audio, signature, info)
+    # The plaintext password never leaves the worker, so results can be cached safely
+    password = result.pop("password", None)
+    if password:
+        result["password_hash"] = hash_password(password)
+    return result
+
+# Jobs that can be sent by name to separate worker processes
+JOBS = {job.__name__: job for job in (encrypt_job, decrypt_job)}
@@ -0,0 +1,161 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+
+from bot.jobs import QueueFullError
+
+# One unit per job plus one per COST_BYTES of upload, so a 50 MB carrier weighs as much as 11 small jobs
+COST_BYTES = 5 * 1024 * 1024
+
+def job_cost(size=0):
+    return 1 + size / COST_BYTES
+
+# A /scan page costs a fifth of a job for the history request plus a quarter per attachment whose
+# header it downloads, so checking four attachments weighs as much as one decrypt
+SCAN_PAGE_COST = 0.2
+SCAN_ATTACHMENT_COST = 0.25
+
+def scan_cost(attachments=0):
+    return SCAN_PAGE_COST + attachments * SCAN_ATTACHMENT_COST
+
+class TokenBucket:
+    def __init__(self, capacity, period, clock=time.monotonic):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, cost):
+        self._refill()
+        return max(0.0, (min(cost, self.capacity) - self.tokens) / self.rate)
+
+    def take(self, cost):
+        # The balance may go negative: a deferred job reserves the tokens it will wait for
+        self._refill()
+        self.tokens -= min(cost, self.capacity)
+
+    def full(self):
+        self._refill()
+        return self.tokens >= self.capacity
+
+class RateLimiter:
+    def __init__(self, user=None, guild=None, total=None, max_wait=30, clock=time.monotonic):
+        # Each limit is (capacity, period in seconds) or None to disable it
+        self.limits = {"user": user, "guild": guild, "global": total}
+        self.max_wait = max_wait
+        self.clock = clock
+        self._buckets = {}
+
+    def _bucket(self, scope, key):
+        bucket = self._buckets.get((scope, key))
+        if bucket is None:
+            bucket = self._buckets[scope, key] = TokenBucket(*self.limits[scope], clock=self.clock)
+        return bucket
+
+    def acquire(self, user_id, guild_id=None, cost=1):
+        # Returns (granted, wait): a granted job has reserved its tokens and may start after `wait`
+        # seconds; a refused one reserved nothing and may retry after `wait` seconds
+        keys = [("user", user_id), ("guild", guild_id), ("global", None)]
+        buckets = [
+            self._bucket(scope, key) for scope, key in keys
+            if self.limits[scope] and (key is not None or scope == "global")
+        ]
+        wait = max((bucket.wait_time(cost) for bucket in buckets), default=0.0)
+        if wait > self.max_wait:
+            return False, wait
+        for bucket in buckets:
+            bucket.take(cost)
+        if len(self._buckets) > 4096:
+            self.prune()
+        return True, wait
+
+    def prune(self):
+        # A full bucket behaves exactly like a new one, so it can be dropped
+        for key in [key for key, bucket in self._buckets.items() if bucket.full()]:
+            del self._buckets[key]
+
+# Start-time fair queueing over a fixed number of job slots. Every job gets a virtual finish tag of
+# max(virtual time, the key's previous finish tag) + cost and free slots go to the smallest tag, so a
+# key that keeps submitting expensive jobs falls behind while a cheap job from anyone else starts next
+class FairScheduler:
+    def __init__(self, slots, max_waiting=None, seconds_per_cost=0.5, clock=time.monotonic):
+        self.slots = slots
+        self.max_waiting = max_waiting
+        self.seconds_per_cost = seconds_per_cost
+        self.clock = clock
+        self.running = 0
+        self.running_cost = 0.0
+        self.virtual_time = 0.0
+        self._finish = {}
+        self._waiting = []
+        self._sequence = itertools.count()
+
+    @property
+    def waiting(self):
+        return sum(not entry[3].cancelled() for entry in self._waiting)
+
+    def busy(self):
+        return self.running >= self.slots or bool(self._waiting)
+
+    def _tags(self, key, cost):
+        start = max(self.virtual_time, self._finish.get(key, 0.0))
+        return start, start + cost
+
+    def estimate(self, key, cost):
+        # Seconds until a job submitted now would start, from the work queued ahead of it
+        if not self.busy():
+            return 0.0
+        _, finish = self._tags(key, cost)
+        ahead = sum(entry[4] for entry in self._waiting if entry[0] <= finish and not entry[3].cancelled())
+        return (ahead + self.running_cost) * self.seconds_per_cost / self.slots
+
+    @asynccontextmanager
+    async def slot(self, key, cost):
+        start, finish = self._tags(key, cost)
+        if self.busy():
+            if self.max_waiting is not None and self.waiting >= self.max_waiting:
+                raise QueueFullError("Scheduler queue is full")
+            future = asyncio.get_running_loop().create_future()
+            self._finish[key] = finish
+            heapq.heappush(self._waiting, (finish, next(self._sequence), start, future, cost))
+            try:
+                await future
+            except asyncio.CancelledError:
+                # The slot may have been handed over just before the cancellation arrived
+                if future.done() and not future.cancelled():
+                    self._release()
+                raise
+        else:
+            self._finish[key] = finish
+            self.running += 1
+
+        self.virtual_time = max(self.virtual_time, start)
+        self.running_cost += cost
+        started = self.clock()
+        try:
+            yield
+        finally:
+            self.running_cost -= cost
+            elapsed = self.clock() - started
+            # Moving average of how long one unit of cost takes, used for ETAs
+            self.seconds_per_cost += 0.2 * (elapsed / cost - self.seconds_per_cost)
+            self._release()
+
+    def _release(self):
+        self.running -= 1
+        while self._waiting and self.running < self.slots:
+            *_, future, _ = heapq.heappop(self._waiting)
+            if not future.cancelled():
+                self.running += 1
+                future.set_result(None)
+        if len(self._finish) > 4096:
+            # Keys whose last job finished in virtual time have no backlog left to remember
+            self._finish = {key: tag for key, tag in self._finish.items() if tag > self.virtual_time}
@@ -0,0 +1,171 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def format_labels(key):
+    if not key:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in key) + "}"
+
+def format_value(value):
+    return str(int(value)) if float(value).is_integer() else f"{value:.6f}"
+
+_clear_refs = {}
+
+def reset_peak_rss():
+    # Linux resets the process high-water mark when "5" is written to clear_refs. The file is
+    # kept open because reopening it would dominate the cost, keyed by PID so forked workers
+    # never write to their parent's file
+    pid = os.getpid()
+    try:
+        if pid not in _clear_refs:
+            _clear_refs[pid] = os.open("/proc/self/clear_refs", os.O_WRONLY)
+        os.write(_clear_refs[pid], b"5")
+        return True
+    except OSError:
+        return False
+
+def peak_rss():
+    if resource is None:
+        return 0
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+class StageTimer:
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0) + time.perf_counter() - started
+
+class Metrics:
+    def __init__(self):
+        self.started = time.time()
+        self._counters = defaultdict(float)
+        self._timers = {}
+        self._maxima = {}
+        self._gauges = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def inc(self, name, amount=1, **labels):
+        with self._lock:
+            self._counters[name, label_key(labels)] += amount
+
+    def observe(self, name, seconds, **labels):
+        key = (name, label_key(labels))
+        with self._lock:
+            count, total, longest = self._timers.get(key, (0, 0.0, 0.0))
+            self._timers[key] = (count + 1, total + seconds, max(longest, seconds))
+
+    def record_max(self, name, value, **labels):
+        key = (name, label_key(labels))
+        with self._lock:
+            self._maxima[key] = max(self._maxima.get(key, 0), value)
+
+    def gauge(self, name, func, **labels):
+        # Gauges are sampled only when rendered, so they cost nothing on the hot path
+        self._gauges[name, label_key(labels)] = func
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def record_job(self, command, stats):
+        for stage, seconds in stats["stages"].items():
+            self.observe("stage_seconds", seconds, command=command, stage=stage)
+        self.observe("job_seconds", stats["seconds"], command=command)
+        if stats["peak_rss"]:
+            self.record_max("job_peak_rss_bytes", stats["peak_rss"], command=command)
+
+    def render(self):
+        with self._lock:
+            counters = sorted(self._counters.items())
+            timers = sorted(self._timers.items())
+            maxima = sorted(self._maxima.items())
+        lines = []
+        seen = set()
+
+        def header(name, kind):
+            if name not in seen:
+                seen.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, key), value in counters:
+            header(name, "counter")
+            lines.append(f"{name}{format_labels(key)} {format_value(value)}")
+        for (name, key), (count, total, longest) in timers:
+            header(name, "summary")
+            lines.append(f"{name}_count{format_labels(key)} {count}")
+            lines.append(f"{name}_sum{format_labels(key)} {format_value(total)}")
+            maxima.append(((f"{name}_max", key), longest))
+        for (name, key), value in sorted(maxima):
+            header(name, "gauge")
+            lines.append(f"{name}{format_labels(key)} {format_value(value)}")
+        for (name, key), func in sorted(self._gauges.items(), key=lambda item: item[0]):
+            header(name, "gauge")
+            lines.append(f"{name}{format_labels(key)} {format_value(func())}")
+        header("uptime_seconds", "gauge")
+        lines.append(f"uptime_seconds {time.time() - self.started:.0f}")
+        return "\n".join(lines) + "\n"
+
+    async def serve(self, host="127.0.0.1", port=9100):
+        async def handle(reader, writer):
+            try:
+                request = await reader.readline()
+                while (await reader.readline()).strip():
+                    pass
+                parts = request.split()
+                if len(parts) >= 2 and parts[1] in (b"/metrics", b"/"):
+                    status, body = "200 OK", self.render().encode()
+                else:
+                    status, body = "404 Not Found", b"not found\n"
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                    f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+                )
+                await writer.drain()
+            finally:
+                writer.close()
+
+        return await asyncio.start_server(handle, host, port)
+
+    async def dump_every(self, interval, write=print):
+        while True:
+            await asyncio.sleep(interval)
+            write(self.render())
+
+metrics = Metrics()
+metrics.describe("stage_seconds", "Time spent in each stage of a command")
+metrics.describe("job_seconds", "Time a worker spent running a job")
+metrics.describe("job_peak_rss_bytes", "Largest worker resident set size seen at the end of a job")
+metrics.describe("errors_total", "Error replies sent, by command and reason")
+metrics.describe("bytes_in_total", "Attachment bytes downloaded")
+metrics.describe("bytes_out_total", "Encoded audio bytes uploaded")
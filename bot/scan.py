@@ -0,0 +1,217 @@
+import asyncio
+import contextlib
+import sqlite3
+import threading
+import time
+
+import discord
+
+from bot.fetch import fetch_payload
+from bot.metrics import metrics
+from steganography.lsb import payload_summary
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS attachments (
+    attachment_id INTEGER PRIMARY KEY,
+    message_id INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    version INTEGER,
+    payload_bytes INTEGER,
+    password INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    scanned REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS attachments_channel ON attachments (channel_id, status, message_id);
+CREATE TABLE IF NOT EXISTS channels (
+    channel_id INTEGER PRIMARY KEY,
+    last_message_id INTEGER NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+# A download that failed is retried on this many later scans before the attachment is given up on
+MAX_ATTEMPTS = 3
+
+class ScanInterrupted(Exception):
+    # Raised by a page slot to end the scan early; pages already recorded are kept
+    def __init__(self, retry_after=None):
+        super().__init__("Scan interrupted")
+        self.retry_after = retry_after
+
+# Persistent map of scanned .wav attachments to their payload metadata, plus the newest message
+# scanned in every channel so the next scan only walks messages posted after it
+class ScanIndex:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def checkpoint(self, channel_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT last_message_id FROM channels WHERE channel_id = ?", (channel_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def known(self, attachment_ids):
+        if not attachment_ids:
+            return set()
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT attachment_id FROM attachments WHERE attachment_id IN ({','.join('?' * len(attachment_ids))})",
+                attachment_ids
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def failed(self, channel_id):
+        # Attachments whose download failed and that are due another attempt, grouped by message
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT message_id, attachment_id FROM attachments "
+                "WHERE channel_id = ? AND status = 'error' AND attempts < ? ORDER BY message_id",
+                (channel_id, MAX_ATTEMPTS)
+            ).fetchall()
+        failed = {}
+        for message_id, attachment_id in rows:
+            failed.setdefault(message_id, set()).add(attachment_id)
+        return failed
+
+    def forget(self, attachment_ids):
+        with self._lock:
+            self._conn.executemany("DELETE FROM attachments WHERE attachment_id = ?", [(i,) for i in attachment_ids])
+
+    def record(self, channel_id, last_message_id, rows):
+        # One transaction per page: the checkpoint only moves past messages whose attachments are stored.
+        # Retried attachments are recorded without a checkpoint
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO attachments (attachment_id, message_id, channel_id, size, status, version, "
+                    "payload_bytes, password, attempts, scanned) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (attachment_id) DO UPDATE SET status = excluded.status, version = excluded.version, "
+                    "payload_bytes = excluded.payload_bytes, password = excluded.password, "
+                    "attempts = attachments.attempts + excluded.attempts, scanned = excluded.scanned",
+                    [(*row, int(row[4] == "error"), now) for row in rows]
+                )
+                if last_message_id is not None:
+                    self._conn.execute(
+                        "INSERT INTO channels (channel_id, last_message_id, updated) VALUES (?, ?, ?) "
+                        "ON CONFLICT (channel_id) DO UPDATE SET "
+                        "last_message_id = MAX(last_message_id, excluded.last_message_id), updated = excluded.updated",
+                        (channel_id, last_message_id, now)
+                    )
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def payloads(self, channel_id, limit=None):
+        # Newest first: (message_id, attachment_id, version, payload_bytes, password)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT message_id, attachment_id, version, payload_bytes, password FROM attachments "
+                "WHERE channel_id = ? AND status = 'payload' ORDER BY message_id DESC LIMIT ?",
+                (channel_id, -1 if limit is None else limit)
+            ).fetchall()
+        return [(message_id, attachment_id, version, size, bool(password))
+                for message_id, attachment_id, version, size, password in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+async def check_attachment(session, message, attachment, signature, semaphore):
+    async with semaphore:
+        try:
+            fetched = await fetch_payload(session, attachment.url, signature, prefix_only=True)
+        except Exception:
+            # The checkpoint moves past this message either way, so the failure is recorded and retried
+            # by the next scans
+            fetched = {"rejected": "error"}
+    metrics.inc("bytes_in_total", fetched.get("bytes_read", 0), command="scan")
+    summary = {}
+    status = fetched.get("rejected")
+    if status is None:
+        summary = payload_summary(fetched["audio"], signature)
+        status = "corrupted" if "error" in summary else "payload"
+    metrics.inc("scan_attachments_total", status=status)
+    return (attachment.id, message.id, message.channel.id, attachment.size, status,
+            summary.get("version"), summary.get("payload_bytes"), summary.get("password"))
+
+def is_wav(attachment):
+    return attachment.filename.lower().endswith(".wav")
+
+async def scan_channel(channel, session, signature, index, concurrency=8, limit=1000, page_size=100,
+                       semaphore=None, slot=None):
+    # Walks the messages after the channel's checkpoint, oldest first, one page at a time. Only the
+    # WAV header and signature span of each new .wav attachment are downloaded, at most `concurrency`
+    # at once (or as many as a `semaphore` shared between scans allows), and attachments already in
+    # the index are never fetched again. `slot(attachments)` returns an async context manager that
+    # every page's downloads run under, e.g. to charge them against rate limits; it may raise
+    # ScanInterrupted to stop after the pages recorded so far
+    semaphore = semaphore or asyncio.Semaphore(concurrency)
+    slot = slot or (lambda attachments: contextlib.nullcontext())
+    stats = {"messages": 0, "attachments": 0, "payloads": 0, "complete": True, "retry_after": None}
+
+    async def check(candidates, last_message_id=None):
+        async with slot(len(candidates)):
+            rows = await asyncio.gather(*(
+                check_attachment(session, message, attachment, signature, semaphore)
+                for message, attachment in candidates
+            ))
+        await asyncio.to_thread(index.record, channel.id, last_message_id, rows)
+        stats["attachments"] += len(rows)
+        stats["payloads"] += sum(row[4] == "payload" for row in rows)
+
+    try:
+        # Downloads that failed during earlier scans are retried first, with fresh attachment URLs
+        for message_id, attachment_ids in (await asyncio.to_thread(index.failed, channel.id)).items():
+            try:
+                message = await channel.fetch_message(message_id)
+            except discord.NotFound:
+                message = None
+            retry = [attachment for attachment in getattr(message, "attachments", []) if attachment.id in attachment_ids]
+            # Deleted messages and removed attachments leave the index
+            gone = attachment_ids - {attachment.id for attachment in retry}
+            if gone:
+                await asyncio.to_thread(index.forget, gone)
+            if retry:
+                await check([(message, attachment) for attachment in retry])
+
+        checkpoint = await asyncio.to_thread(index.checkpoint, channel.id)
+        history = channel.history(
+            limit=limit, after=discord.Object(checkpoint) if checkpoint else None, oldest_first=True
+        )
+
+        async def scan_page(page):
+            candidates = [
+                (message, attachment) for message in page for attachment in message.attachments if is_wav(attachment)
+            ]
+            known = await asyncio.to_thread(index.known, [attachment.id for _, attachment in candidates])
+            candidates = [(message, attachment) for message, attachment in candidates if attachment.id not in known]
+            await check(candidates, page[-1].id)
+            stats["messages"] += len(page)
+            metrics.inc("scan_messages_total", len(page))
+
+        page = []
+        async for message in history:
+            page.append(message)
+            if len(page) >= page_size:
+                await scan_page(page)
+                page = []
+        if page:
+            await scan_page(page)
+    except ScanInterrupted as e:
+        stats["complete"] = False
+        stats["retry_after"] = e.retry_after
+        return stats
+    # A full run may have stopped short of the newest message
+    stats["complete"] = limit is None or stats["messages"] < limit
+    return stats
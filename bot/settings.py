@@ -0,0 +1,101 @@
+import os
+from dataclasses import dataclass, field
+
+def env_flag(value):
+    return (value or "").strip().lower() in ("1", "true", "yes")
+
+def parse_shards(value):
+    # "0-3" or "0,2,5"; None hosts every shard in this process
+    if not (value or "").strip():
+        return None
+    shard_ids = []
+    for part in value.split(","):
+        first, _, last = part.strip().partition("-")
+        shard_ids.extend(range(int(first), int(last or first) + 1))
+    return shard_ids
+
+def parse_rate(value, default):
+    # "20/60" allows 20 cost units per 60 seconds; "0" or "off" disables the limit
+    value = (value or default).strip().lower()
+    if value in ("0", "off", "none"):
+        return None
+    capacity, _, period = value.partition("/")
+    return float(capacity), float(period or 60)
+
+def parse_carriers(value):
+    paths = [path.strip() for path in (value or "").split(",") if path.strip()]
+    return {os.path.splitext(os.path.basename(path))[0]: path for path in paths}
+
+@dataclass
+class Settings:
+    token: str = None
+    signature: str = None
+    updates_channel: int = None
+    workers: int = None
+    worker_mode: str = "process"
+    job_queue: int = None
+    job_timeout: float = 120
+    default_carrier: str = "./default.wav"
+    carriers: dict = field(default_factory=dict)
+    resample_rate: int = None
+    trim_carrier: bool = False
+    decrypt_cache_size: int = 1024
+    decrypt_cache_bytes: int = 8 * 1024 * 1024
+    decrypt_cache_ttl: float = 3600
+    metrics_host: str = "127.0.0.1"
+    metrics_port: int = None
+    metrics_interval: float = None
+    shard_count: int = None
+    shard_ids: list = None
+    work_queue: str = None
+    rate_user: tuple = (20, 60)
+    rate_guild: tuple = (60, 60)
+    rate_global: tuple = (300, 60)
+    rate_max_wait: float = 30
+    scan_index: str = "./scan_index.db"
+    scan_concurrency: int = 8
+    scan_limit: int = 1000
+
+def load_settings(env=None, dotenv=True, require_token=True):
+    if env is None:
+        if dotenv:
+            # Imported here so library code and worker processes never need python-dotenv
+            from dotenv import load_dotenv
+            load_dotenv()
+        env = os.environ
+
+    settings = Settings(
+        token=env.get("TOKEN"),
+        signature=env.get("SIGNATURE"),
+        updates_channel=int(env["UPDATES"]) if env.get("UPDATES") else None,
+        workers=int(env.get("WORKERS") or 0) or None,
+        worker_mode=env.get("WORKER_MODE") or "process",
+        job_queue=int(env.get("JOB_QUEUE") or 0) or None,
+        job_timeout=float(env.get("JOB_TIMEOUT") or 120),
+        carriers=parse_carriers(env.get("CARRIERS")),
+        resample_rate=int(env.get("RESAMPLE") or 0) or None,
+        trim_carrier=env_flag(env.get("TRIM_CARRIER")),
+        decrypt_cache_size=int(env.get("DECRYPT_CACHE_SIZE") or 1024),
+        decrypt_cache_bytes=int(float(env.get("DECRYPT_CACHE_MB") or 8) * 1024 * 1024),
+        decrypt_cache_ttl=float(env.get("DECRYPT_CACHE_TTL") or 3600),
+        metrics_host=env.get("METRICS_HOST") or "127.0.0.1",
+        metrics_port=int(env.get("METRICS_PORT") or 0) or None,
+        metrics_interval=float(env.get("METRICS_INTERVAL") or 0) or None,
+        shard_count=int(env.get("SHARD_COUNT") or 0) or None,
+        shard_ids=parse_shards(env.get("SHARD_IDS")),
+        work_queue=env.get("WORK_QUEUE") or None,
+        rate_user=parse_rate(env.get("RATE_USER"), "20/60"),
+        rate_guild=parse_rate(env.get("RATE_GUILD"), "60/60"),
+        rate_global=parse_rate(env.get("RATE_GLOBAL"), "300/60"),
+        rate_max_wait=float(env.get("RATE_MAX_WAIT") or 30),
+        scan_index=env.get("SCAN_INDEX") or "./scan_index.db",
+        scan_concurrency=int(env.get("SCAN_CONCURRENCY") or 8),
+        scan_limit=int(env.get("SCAN_LIMIT") or 1000),
+    )
+    if settings.shard_ids is not None and not settings.shard_count:
+        raise ValueError("SHARD_IDS requires SHARD_COUNT")
+    if require_token and not settings.token:
+        raise ValueError("TOKEN is not set")
+    if not settings.signature or set(settings.signature) - {"0", "1"}:
+        raise ValueError("SIGNATURE must be a non-empty binary string")
+    return settings
@@ -0,0 +1,92 @@
+import argparse
+import functools
+import multiprocessing
+import os
+import socket
+import time
+import traceback
+
+from bot.jobs import JOBS, preload_carriers, run_job
+from bot.settings import load_settings
+from bot.workqueue import WorkQueue
+
+RESULT_TTL = 3600
+PURGE_INTERVAL = 60
+
+def worker_name(pid):
+    return f"{socket.gethostname()}:{pid}"
+
+def stop(process):
+    process.terminate()
+    process.join()
+
+def work(path, carriers, resample_rate, poll_interval=0.05, max_poll_interval=0.5):
+    preload_carriers(carriers, resample_rate)
+    queue = WorkQueue(path)
+    name = worker_name(os.getpid())
+    delay = poll_interval
+    while True:
+        job = queue.claim(name)
+        if job is None:
+            # Back off while idle so an empty queue costs almost nothing
+            time.sleep(delay)
+            delay = min(delay * 2, max_poll_interval)
+            continue
+        delay = poll_interval
+        job_id, func_name, args, kwargs = job
+        try:
+            queue.finish(job_id, result=run_job(JOBS[func_name], args, kwargs))
+        except Exception as e:
+            traceback.print_exc()
+            queue.finish(job_id, error=str(e))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run encode/decode workers that consume the shared work queue")
+    parser.add_argument("--queue", help="SQLite work queue (defaults to $WORK_QUEUE)")
+    parser.add_argument("--workers", type=int, help="Worker processes (defaults to $WORKERS, then the CPU count)")
+    args = parser.parse_args(argv)
+
+    settings = load_settings(require_token=False)
+    path = args.queue or settings.work_queue
+    if not path:
+        parser.error("a work queue is required (--queue or $WORK_QUEUE)")
+    workers = args.workers or settings.workers or os.cpu_count() or 1
+    # Creates the database and schema before the workers start racing for it; the connection is
+    # closed first because SQLite connections must not be carried across fork
+    WorkQueue(path).close()
+
+    carriers = [settings.default_carrier, *settings.carriers.values()]
+
+    def start():
+        process = multiprocessing.Process(target=work, args=(path, carriers, settings.resample_rate), daemon=True)
+        process.start()
+        return process
+
+    processes = [start() for _ in range(workers)]
+    print(f"{workers} workers consuming {path}")
+    queue = WorkQueue(path)
+    last_purge = time.monotonic()
+
+    try:
+        while True:
+            time.sleep(1)
+            # A running job cannot be interrupted, so a worker whose job was cancelled or timed out is
+            # terminated; the loop below replaces it
+            names = {worker_name(process.pid): process for process in processes}
+            for job_id, name in queue.abandoned(list(names)):
+                queue.reap(job_id, name, functools.partial(stop, names[name]))
+            if time.monotonic() - last_purge >= PURGE_INTERVAL:
+                queue.purge(RESULT_TTL)
+                last_purge = time.monotonic()
+            # Replace workers that crashed, e.g. after running out of memory on a huge carrier
+            for i, process in enumerate(processes):
+                if not process.is_alive():
+                    processes[i] = start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+import asyncio
+import pickle
+import sqlite3
+import threading
+import time
+
+from bot.jobs import QueueFullError
+from bot.metrics import metrics
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    func TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    result BLOB,
+    worker TEXT,
+    created REAL NOT NULL,
+    deadline REAL NOT NULL,
+    started REAL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+"""
+
+# A job table shared by gateway processes, which insert jobs and collect results,
+# and worker processes, which claim and run them
+class WorkQueue:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        # WAL lets workers claim jobs while gateways poll for results without blocking each other
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def _transaction(self, func):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def put(self, func_name, args, kwargs, timeout):
+        now = time.time()
+        payload = pickle.dumps((args, kwargs), protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO jobs (func, payload, created, deadline) VALUES (?, ?, ?, ?)",
+                (func_name, payload, now, now + timeout)
+            )
+            return cursor.lastrowid
+
+    def claim(self, worker):
+        def claim_next(conn):
+            now = time.time()
+            # Jobs whose submitter has already given up are dropped instead of run
+            conn.execute("DELETE FROM jobs WHERE status = 'queued' AND deadline < ?", (now,))
+            row = conn.execute(
+                "SELECT id, func, payload FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, started = ?, payload = x'' WHERE id = ?",
+                (worker, now, row[0])
+            )
+            return row
+
+        row = self._transaction(claim_next)
+        if row is None:
+            return None
+        job_id, func_name, payload = row
+        args, kwargs = pickle.loads(payload)
+        return job_id, func_name, args, kwargs
+
+    def finish(self, job_id, result=None, error=None):
+        status = "failed" if error is not None else "done"
+        value = pickle.dumps(error if error is not None else result, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, finished = ? WHERE id = ? AND status = 'running'",
+                (status, value, time.time(), job_id)
+            )
+            # Nobody is waiting for a job that was cancelled while running, so its result is dropped
+            self._conn.execute("DELETE FROM jobs WHERE id = ? AND status = 'cancelled'", (job_id,))
+
+    def take(self, job_id):
+        def take_result(conn):
+            row = conn.execute("SELECT status, result FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None or row[0] in ("queued", "running"):
+                return row
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            return row
+
+        row = self._transaction(take_result)
+        if row is None:
+            # Expired jobs are deleted by workers before they are claimed
+            return "expired", None
+        status, result = row
+        if status in ("queued", "running"):
+            return status, None
+        return status, pickle.loads(result)
+
+    def cancel(self, job_id):
+        # A queued job is dropped; a running one is marked so its worker's supervisor stops it, and
+        # keeps counting towards the queue depth until then
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs WHERE id = ? AND status != 'running'", (job_id,))
+            self._conn.execute("UPDATE jobs SET status = 'cancelled' WHERE id = ? AND status = 'running'", (job_id,))
+
+    def abandoned(self, workers):
+        # Jobs run by these workers that were cancelled, or that outlived the submitter's timeout
+        if not workers:
+            return []
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT id, worker FROM jobs WHERE worker IN ({','.join('?' * len(workers))}) "
+                "AND (status = 'cancelled' OR (status = 'running' AND deadline < ?))",
+                (*workers, time.time())
+            ).fetchall()
+
+    def reap(self, job_id, worker, stop):
+        # Calls stop() and drops the job if it is still abandoned by that worker. Between abandoned() and
+        # here the worker may have finished it and claimed another job, which must not be stopped; the
+        # row is re-checked under the write lock, which the worker needs to finish or claim anything
+        def reap_job(conn):
+            row = conn.execute(
+                "SELECT 1 FROM jobs WHERE id = ? AND worker = ? "
+                "AND (status = 'cancelled' OR (status = 'running' AND deadline < ?))",
+                (job_id, worker, time.time())
+            ).fetchone()
+            if row is None:
+                return False
+            stop()
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            return True
+
+        return self._transaction(reap_job)
+
+    def depth(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running', 'cancelled')"
+            ).fetchone()[0]
+
+    def purge(self, older_than, stale_after=60):
+        # Removes results nobody collected, e.g. after a gateway restart, and jobs still queued or
+        # running well past their deadline. Those were left by a worker that crashed, or by a gateway or
+        # host that went away, and would otherwise count towards the queue depth forever
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished < ?",
+                (now - older_than,)
+            )
+            self._conn.execute(
+                "DELETE FROM jobs WHERE status IN ('queued', 'running', 'cancelled') AND deadline < ?",
+                (now - stale_after,)
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+# Same interface as JobExecutor, but jobs run in separate `python -m bot.worker` processes
+class QueueExecutor:
+    def __init__(self, path, max_queue=None, timeout=120, poll_interval=0.02, max_poll_interval=0.25):
+        self.queue = WorkQueue(path)
+        self.max_queue = max_queue or 16
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.pending = 0
+
+    async def submit(self, func, *args, timeout=None, **kwargs):
+        command = func.__name__.removesuffix("_job")
+        timeout = timeout or self.timeout
+        # pending guards bursts from this process; the shared queue depth covers every gateway process
+        self.pending += 1
+        job_id = None
+        try:
+            if self.pending > self.max_queue or await asyncio.to_thread(self.queue.depth) >= self.max_queue:
+                metrics.inc("jobs_rejected_total", command=command)
+                raise QueueFullError("Job queue is full")
+            job_id = await asyncio.to_thread(self.queue.put, func.__name__, args, kwargs, timeout)
+            result = await asyncio.wait_for(self._wait(job_id, command), timeout)
+            job_id = None
+            return result
+        finally:
+            self.pending -= 1
+            if job_id is not None:
+                # Drops the job if no worker has claimed it; a running job is stopped by its worker supervisor
+                await asyncio.to_thread(self.queue.cancel, job_id)
+
+    async def _wait(self, job_id, command):
+        delay = self.poll_interval
+        while True:
+            status, value = await asyncio.to_thread(self.queue.take, job_id)
+            if status == "done":
+                result, stats = value
+                metrics.record_job(command, stats)
+                return result
+            if status == "failed":
+                raise RuntimeError(value)
+            if status == "expired":
+                raise asyncio.TimeoutError()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_poll_interval)
+
+    def shutdown(self):
+        self.queue.close()
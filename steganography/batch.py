@@ -0,0 +1,95 @@
+import argparse
+import functools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from audio.processing import probe_wav
+from steganography.lsb import audio_to_text, text_to_audio, verify_audio_signature
+
+def load_tasks(source):
+    # A directory is scanned for .wav files; anything else is a manifest of paths or JSON objects, one per line
+    if os.path.isdir(source):
+        for root, _, files in os.walk(source):
+            for name in sorted(files):
+                if name.lower().endswith(".wav"):
+                    yield {"path": os.path.join(root, name)}
+        return
+    with open(source, encoding="utf-8") as manifest:
+        for line in manifest:
+            line = line.strip()
+            if line:
+                yield json.loads(line) if line.startswith("{") else {"path": line}
+
+def scan_file(task, signature, info=None):
+    path = task["path"]
+    info = info or probe_wav(path)
+    return {"path": path, "bytes": os.path.getsize(path), "valid": info is not None,
+            "signature": info is not None and verify_audio_signature(path, signature, info)}
+
+def decode_file(task, signature):
+    info = probe_wav(task["path"])
+    result = scan_file(task, signature, info)
+    if result["signature"]:
+        result.update(audio_to_text(task["path"], signature, info))
+    return result
+
+def encode_file(task, signature):
+    text_to_audio(
+        task["text"], task["path"], task["output"], signature,
+        password=task.get("password"), exceptions=task.get("exceptions"),
+        bits_per_sample=task.get("bits_per_sample"), trim=task.get("trim", False)
+    )
+    return {"path": task["path"], "bytes": os.path.getsize(task["path"]), "output": task["output"]}
+
+OPERATIONS = {"scan": scan_file, "decode": decode_file, "encode": encode_file}
+
+def run_task(operation, signature, task):
+    try:
+        return OPERATIONS[operation](task, signature)
+    except Exception as e:
+        return {"path": task.get("path"), "error": str(e)}
+
+def run_batch(operation, tasks, signature, workers=None, chunksize=16):
+    if operation not in OPERATIONS:
+        raise ValueError(f"Unknown operation: {operation}")
+    worker = functools.partial(run_task, operation, signature)
+    if workers == 1:
+        yield from map(worker, tasks)
+        return
+    # Chunks amortize the per-task IPC cost; results are yielded in input order as they complete
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(worker, tasks, chunksize=chunksize)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Encode, decode or scan many WAV files in parallel")
+    parser.add_argument("operation", choices=sorted(OPERATIONS))
+    parser.add_argument("source", help="Directory of .wav files, or a manifest with one path or JSON task per line")
+    parser.add_argument("--signature", default=os.getenv("SIGNATURE"), help="Binary signature (defaults to $SIGNATURE)")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunksize", type=int, default=16)
+    args = parser.parse_args(argv)
+    if not args.signature:
+        parser.error("a signature is required (--signature or $SIGNATURE)")
+    if not os.path.exists(args.source):
+        parser.error(f"no such directory or manifest: {args.source}")
+
+    started = time.perf_counter()
+    files = total_bytes = failures = 0
+    for result in run_batch(args.operation, load_tasks(args.source), args.signature, args.workers, args.chunksize):
+        sys.stdout.write(json.dumps(result, ensure_ascii=False) + "\n")
+        files += 1
+        total_bytes += result.get("bytes", 0)
+        failures += "error" in result
+
+    elapsed = max(time.perf_counter() - started, 1e-9)
+    print(
+        f"{files} files ({failures} failed), {total_bytes / (1024 * 1024):.1f} MB in {elapsed:.2f}s: "
+        f"{files / elapsed:.1f} files/s, {total_bytes / (1024 * 1024) / elapsed:.1f} MB/s",
+        file=sys.stderr
+    )
+
+if __name__ == "__main__":
+    main()
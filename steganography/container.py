@@ -0,0 +1,133 @@
+import struct
+import zlib
+
+# Payload version 3 body: varint(len(content)) + content + CRC32(content), where content is a flags
+# byte followed by the fields the flags announce, and the message text fills the rest
+FLAG_PASSWORD = 0x01
+FLAG_EXCEPTION_IDS = 0x02
+FLAG_EXCEPTION_TEXT = 0x04
+FLAG_COMPRESSED = 0x08
+KNOWN_FLAGS = FLAG_PASSWORD | FLAG_EXCEPTION_IDS | FLAG_EXCEPTION_TEXT | FLAG_COMPRESSED
+
+MAX_VARINT_BYTES = 5
+MAX_TEXT_BYTES = 1 << 20
+CRC_BYTES = 4
+
+class ContainerError(ValueError):
+    pass
+
+def encode_varint(value):
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+def decode_varint(data, position=0):
+    value = 0
+    for i in range(MAX_VARINT_BYTES):
+        if position >= len(data):
+            raise ContainerError("truncated length")
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << (7 * i)
+        if not byte & 0x80:
+            return value, position
+    raise ContainerError("length field too long")
+
+def pack_ids(exceptions):
+    # Discord IDs are 64-bit snowflakes: 8 bytes each instead of up to 20 as comma-separated text.
+    # Anything that would not round-trip exactly is left to the text encoding
+    if not all(e.isdigit() and str(int(e)) == e and int(e) < 1 << 64 for e in exceptions):
+        return None
+    return encode_varint(len(exceptions)) + struct.pack(f'>{len(exceptions)}Q', *map(int, exceptions))
+
+def pack_container(password, exceptions, text):
+    flags = 0
+    fields = []
+    if password:
+        flags |= FLAG_PASSWORD
+        pass_bytes = password.encode('utf-8')
+        fields += [encode_varint(len(pass_bytes)), pass_bytes]
+    if exceptions:
+        packed = pack_ids(exceptions)
+        if packed is not None:
+            flags |= FLAG_EXCEPTION_IDS
+            fields.append(packed)
+        else:
+            flags |= FLAG_EXCEPTION_TEXT
+            except_bytes = ','.join(exceptions).encode('utf-8')
+            fields += [encode_varint(len(except_bytes)), except_bytes]
+
+    text_bytes = text.encode('utf-8')
+    compressed = zlib.compress(text_bytes, 9)
+    if len(compressed) < len(text_bytes):
+        flags |= FLAG_COMPRESSED
+        text_bytes = compressed
+    fields.append(text_bytes)
+
+    content = bytes([flags]) + b"".join(fields)
+    return encode_varint(len(content)) + content + struct.pack('>I', zlib.crc32(content))
+
+def container_size(prefix):
+    # Total container length in bytes, from its first MAX_VARINT_BYTES bytes
+    length, position = decode_varint(prefix)
+    return position + length + CRC_BYTES
+
+def container_flags(prefix):
+    # The flags byte follows the length, so the first MAX_VARINT_BYTES + 1 bytes always contain it
+    _, position = decode_varint(prefix)
+    if position >= len(prefix):
+        raise ContainerError("truncated payload")
+    flags = prefix[position]
+    if flags & ~KNOWN_FLAGS:
+        raise ContainerError("unsupported flags")
+    return flags
+
+def read_field(content, position):
+    length, position = decode_varint(content, position)
+    if position + length > len(content):
+        raise ContainerError("field exceeds payload")
+    return content[position:position + length], position + length
+
+def unpack_container(data):
+    length, position = decode_varint(data)
+    if position + length + CRC_BYTES > len(data) or length < 1:
+        raise ContainerError("truncated payload")
+    content = data[position:position + length]
+    checksum, = struct.unpack_from('>I', data, position + length)
+    if zlib.crc32(content) != checksum:
+        raise ContainerError("checksum mismatch")
+
+    flags = content[0]
+    if flags & ~KNOWN_FLAGS or (flags & FLAG_EXCEPTION_IDS and flags & FLAG_EXCEPTION_TEXT):
+        raise ContainerError("unsupported flags")
+    position = 1
+    password = exceptions = None
+    try:
+        if flags & FLAG_PASSWORD:
+            pass_bytes, position = read_field(content, position)
+            password = pass_bytes.decode('utf-8')
+        if flags & FLAG_EXCEPTION_IDS:
+            count, position = decode_varint(content, position)
+            if position + 8 * count > len(content):
+                raise ContainerError("field exceeds payload")
+            ids = struct.unpack_from(f'>{count}Q', content, position)
+            position += 8 * count
+            exceptions = ','.join(map(str, ids))
+        elif flags & FLAG_EXCEPTION_TEXT:
+            except_bytes, position = read_field(content, position)
+            exceptions = except_bytes.decode('utf-8')
+
+        text_bytes = content[position:]
+        if flags & FLAG_COMPRESSED:
+            # Bounded so a crafted payload cannot inflate without limit
+            decompressor = zlib.decompressobj()
+            text_bytes = decompressor.decompress(text_bytes, MAX_TEXT_BYTES)
+            if decompressor.unconsumed_tail or not decompressor.eof:
+                raise ContainerError("invalid compressed text")
+        text = text_bytes.decode('utf-8')
+    except (UnicodeDecodeError, zlib.error) as e:
+        raise ContainerError(str(e)) from e
+    return {"password": password, "exceptions": exceptions, "text": text}
@@ -1,100 +1,325 @@
+import mmap
 import numpy as np
 import secrets
+import shutil
 import string
-from audio.processing import load_wave, save_wave, loop_audio
+import struct
+from audio.processing import is_path, loop_blocks, read_bytes, read_frames, read_wav_info, save_wave_blocks
+from steganography.container import (
+    FLAG_PASSWORD, MAX_VARINT_BYTES, ContainerError, container_flags, container_size, pack_container, unpack_container
+)
 
-def bits_to_array(bits_str, dtype=np.int16):
-    return np.array([int(bit) for bit in bits_str], dtype=dtype)
+# Versioned payloads set the first (legacy pass-length) field to 0xFFFF, which legacy files never
+# use since their lengths are multiples of 8 bits
+FORMAT_MARKER = 0xFFFF
+# Version 2 bodies are three 16-bit byte lengths and the raw fields; version 3 bodies are the
+# compressed, checksummed container from steganography.container
+FORMAT_VERSION = 3
+SUPPORTED_VERSIONS = (2, 3)
+FORMAT_HEADER_BITS = 32
+MAX_BITS_PER_SAMPLE = 4
+MAX_SPREAD_CHANNELS = 15
+
+def bytes_to_bits(data):
+    return np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+
+def bits_to_bytes(bits):
+    return np.packbits(bits).tobytes()
+
+def signature_to_bits(signature):
+    return np.frombuffer(signature.encode('ascii'), dtype=np.uint8) - ord('0')
+
+def parse_length_header(bits):
+    return [int(n) for n in np.frombuffer(bits_to_bytes(bits), dtype='>u2')]
 
 def embed_bits(audio_channel, bits):
-    bits_array = bits_to_array(bits)
     audio_channel = audio_channel.copy()
-    end = len(bits_array)
-    audio_channel[:end] = (audio_channel[:end] & ~1) | bits_array
+    end = len(bits)
+    # XOR form keeps the dtype of unsigned (8-bit) and 32-bit samples intact
+    audio_channel[:end] ^= (audio_channel[:end] ^ bits) & 1
     return audio_channel
 
 def extract_bits(audio_channel, num_bits):
     return (audio_channel[:num_bits] & 1).astype(np.uint8)
 
-def text_to_binary(text):
-    utf8_bytes = text.encode('utf-8')
-    bits = [f"{byte:08b}" for byte in utf8_bytes]
-    return ''.join(bits)
+def pack_samples(bits, bits_per_sample):
+    groups = np.pad(bits, (0, -len(bits) % bits_per_sample)).reshape(-1, bits_per_sample)
+    shifts = np.arange(bits_per_sample - 1, -1, -1, dtype=np.uint8)
+    return (groups << shifts).sum(axis=1, dtype=np.uint8)
+
+def unpack_samples(values, bits_per_sample, num_bits):
+    shifts = np.arange(bits_per_sample - 1, -1, -1)
+    return ((values[:, None] >> shifts) & 1).astype(np.uint8).reshape(-1)[:num_bits]
 
-def binary_to_text(binary):
-    bytes_list = [int(binary[i:i+8], 2) for i in range(0, len(binary), 8)]
-    return bytes(bytes_list).decode('utf-8', errors='replace')
+def body_frames(num_bits, bits_per_sample, channels):
+    return -(-num_bits // (bits_per_sample * channels))
+
+def low_bytes(samples):
+    # PCM is little-endian, so the low bits of each sample live in its first byte
+    return samples.view(np.uint8).reshape(len(samples), -1, samples.itemsize)[:, :, 0]
 
 def generate_random_filename(length=10, extension=".wav"):
     characters = string.ascii_letters + string.digits
     random_string = ''.join(secrets.choice(characters) for _ in range(length))
     return f"{random_string}{extension}"
 
-def text_to_audio(input_text, song_file, output_file, signature, password=None, exceptions=None):
-    pass_bin = text_to_binary(password or "") if password else ""
-    except_bin = text_to_binary(','.join(exceptions or []))
-    text_bin = text_to_binary(input_text)
-    
-    metadata = (
-        signature +
-        f"{len(pass_bin):016b}" +
-        f"{len(except_bin):016b}" +
-        f"{len(text_bin):016b}" +
-        pass_bin +
-        except_bin +
-        text_bin
-    )
+def build_header(signature, bits_per_sample, channels, version=FORMAT_VERSION):
+    # Anything read_layout would refuse must not be written in the first place
+    if version not in SUPPORTED_VERSIONS:
+        raise ValueError(f"Unsupported payload version: {version}")
+    if not 1 <= bits_per_sample <= MAX_BITS_PER_SAMPLE:
+        raise ValueError(f"bits_per_sample must be between 1 and {MAX_BITS_PER_SAMPLE}")
+    return np.concatenate((
+        signature_to_bits(signature),
+        bytes_to_bits(struct.pack('>HBB', FORMAT_MARKER, version, (bits_per_sample << 4) | channels))
+    ))
+
+def build_body(password, exceptions, input_text, version=FORMAT_VERSION):
+    if version == 3:
+        return bytes_to_bits(pack_container(password, exceptions, input_text))
+    pass_bytes = password.encode('utf-8') if password else b""
+    except_bytes = ','.join(exceptions or []).encode('utf-8')
+    text_bytes = input_text.encode('utf-8')
+    lengths = struct.pack('>HHH', len(pass_bytes), len(except_bytes), len(text_bytes))
+    return bytes_to_bits(lengths + pass_bytes + except_bytes + text_bytes)
+
+def choose_bits_per_sample(n_frames, header_len, body_len, channels):
+    # Use as few LSBs as possible, adding more only when the carrier would otherwise need looping
+    for bits_per_sample in range(1, MAX_BITS_PER_SAMPLE + 1):
+        if header_len + body_frames(body_len, bits_per_sample, channels) <= n_frames:
+            return bits_per_sample
+    return MAX_BITS_PER_SAMPLE
+
+def embed_payload(lsb_bytes, header, body, bits_per_sample, channels):
+    embed_range(lsb_bytes, 0, header, pack_samples(body, bits_per_sample), bits_per_sample, channels)
+
+def embed_range(lsb_bytes, start, header, values, bits_per_sample, channels):
+    # Embeds the part of the payload that falls in frames [start, start + len(lsb_bytes)). The header
+    # always takes one bit per left-channel sample; the body values are spread over `channels`
+    # channels at `bits_per_sample` bits each, starting right after it
+    end = start + len(lsb_bytes)
+    if start < len(header):
+        left_channel = lsb_bytes[:min(end, len(header)) - start, 0]
+        left_channel ^= (left_channel ^ header[start:start + len(left_channel)]) & 1
+
+    first = max(start, len(header))
+    last = min(end, len(header) + -(-len(values) // channels))
+    if first < last:
+        chunk = values[(first - len(header)) * channels:(last - len(header)) * channels]
+        region = lsb_bytes[first - start:last - start, :channels]
+        flat = region.reshape(-1).copy()
+        flat[:len(chunk)] ^= (flat[:len(chunk)] ^ chunk) & ((1 << bits_per_sample) - 1)
+        region[...] = flat.reshape(region.shape)
+
+def encode_blocks(blocks, header, body, bits_per_sample, channels):
+    # Only blocks overlapping the payload are copied and patched; the rest pass through untouched
+    values = pack_samples(body, bits_per_sample)
+    payload_end = len(header) + -(-len(values) // channels)
+    position = 0
+    for block in blocks:
+        if position < payload_end:
+            block = block.copy()
+            embed_range(low_bytes(block), position, header, values, bits_per_sample, channels)
+        position += len(block)
+        yield block
+
+def patch_frames(buffer, offset, params, header, body, bits_per_sample, channels, required_length):
+    frame_size = params.nchannels * params.sampwidth
+    frames = np.frombuffer(buffer, dtype=np.uint8, count=required_length * frame_size, offset=offset)
+    lsb_bytes = frames.reshape(required_length, params.nchannels, params.sampwidth)[:, :, 0]
+    embed_payload(lsb_bytes, header, body, bits_per_sample, channels)
+
+def embed_in_place(song_file, output_file, params, header, body, bits_per_sample, channels, required_length):
+    # The output is a verbatim copy, so its data chunk starts where the carrier's does
+    offset = params.data_offset
+    frame_size = params.nchannels * params.sampwidth
+
+    if not is_path(output_file):
+        # In-memory sinks get a verbatim copy of the carrier, patched through the buffer itself
+        output_file.seek(0)
+        output_file.truncate()
+        output_file.write(read_bytes(song_file))
+        with output_file.getbuffer() as buffer:
+            patch_frames(buffer, offset, params, header, body, bits_per_sample, channels, required_length)
+        return
+
+    # The kernel copies the carrier (sendfile on Linux); only the pages holding the payload are mapped and patched
+    if is_path(song_file):
+        shutil.copyfile(song_file, output_file)
+    else:
+        with open(output_file, 'wb') as f:
+            f.write(read_bytes(song_file))
+    with open(output_file, 'r+b') as wav_file:
+        with mmap.mmap(wav_file.fileno(), offset + required_length * frame_size) as mapped:
+            patch_frames(mapped, offset, params, header, body, bits_per_sample, channels, required_length)
+            mapped.flush()
+
+def text_to_audio(input_text, song_file, output_file, signature, password=None, exceptions=None,
+                  in_place=True, bits_per_sample=None, trim=False, version=FORMAT_VERSION):
+    body = build_body(password, exceptions, input_text, version)
 
-    sample_rate, audio_data = load_wave(song_file)
+    if isinstance(song_file, tuple):
+        # Pre-decoded (sample_rate, data, sampwidth) carrier, possibly a read-only array shared through the carrier cache
+        sample_rate, audio_data, sampwidth = song_file
+        n_frames = len(audio_data)
+        n_channels = audio_data.shape[1] if audio_data.ndim > 1 else 1
+    else:
+        params = read_wav_info(song_file)
+        sample_rate, n_channels, sampwidth, n_frames = params.framerate, params.nchannels, params.sampwidth, params.nframes
 
-    if len(audio_data.shape) == 1:
-        audio_data = np.column_stack((audio_data, audio_data))
-    elif audio_data.shape[1] == 1:
-        audio_data = np.column_stack((audio_data.flatten(), audio_data.flatten()))
+    channels = min(n_channels, MAX_SPREAD_CHANNELS)
+    header_len = len(signature) + FORMAT_HEADER_BITS
+    if bits_per_sample is None:
+        bits_per_sample = choose_bits_per_sample(n_frames, header_len, len(body), channels)
+    header = build_header(signature, bits_per_sample, channels, version)
+    required_length = header_len + body_frames(len(body), bits_per_sample, channels)
 
-    required_length = len(metadata)
-    if required_length > len(audio_data):
-        audio_data = loop_audio(audio_data, required_length)
+    if isinstance(song_file, tuple):
+        read = lambda start, count: audio_data[start:start + count]
+    else:
+        if n_frames >= required_length and in_place and not trim and (is_path(output_file) or hasattr(output_file, 'getbuffer')):
+            embed_in_place(song_file, output_file, params, header, body, bits_per_sample, channels, required_length)
+            return output_file
+        read = lambda start, count: read_frames(song_file, start, count, params)
 
-    left_channel = audio_data[:, 0].copy()
-    audio_data[:, 0] = embed_bits(left_channel, metadata)
-    
-    save_wave(output_file, sample_rate, audio_data)
+    # The carrier is streamed block by block: trimming stops at the end of the payload, and a carrier
+    # shorter than the payload is looped by reading it again from the start
+    total_frames = required_length if trim else max(n_frames, required_length)
+    blocks = loop_blocks(read, n_frames, total_frames)
+    save_wave_blocks(output_file, sample_rate, encode_blocks(blocks, header, body, bits_per_sample, channels), sampwidth)
     return output_file
 
-def verify_audio_signature(input_file, signature):
-    _, audio_data = load_wave(input_file)
-    left_channel = audio_data[:, 0] if audio_data.ndim > 1 else audio_data
+def read_left_channel(input_file, start, count, info=None):
+    audio_data = read_frames(input_file, start, count, info)
+    return audio_data[:, 0] if audio_data.ndim > 1 else audio_data
+
+def read_body(input_file, start, num_bits, bits_per_sample, channels, info=None):
+    n_frames = body_frames(num_bits, bits_per_sample, channels)
+    samples = read_frames(input_file, start, n_frames, info)
+    if len(samples) < n_frames:
+        return None
+    values = samples.reshape(n_frames, -1)[:, :channels].reshape(-1) & ((1 << bits_per_sample) - 1)
+    return unpack_samples(values, bits_per_sample, num_bits)
+
+def verify_audio_signature(input_file, signature, info=None):
+    # Reads only the first len(signature) frames
+    left_channel = read_left_channel(input_file, 0, len(signature), info)
 
     if len(signature) > len(left_channel):
         return False
-    extracted_sig = ''.join(map(str, extract_bits(left_channel, len(signature))))
-    return extracted_sig == signature
+    return np.array_equal(extract_bits(left_channel, len(signature)), signature_to_bits(signature))
 
-def audio_to_text(input_file, signature):
-    _, audio_data = load_wave(input_file)
-    left_channel = audio_data[:, 0] if audio_data.ndim > 1 else audio_data
+def decode_fields(pass_bytes, except_bytes, text_bytes):
+    password = pass_bytes.decode('utf-8', errors='replace') if pass_bytes else None
+    exceptions = except_bytes.decode('utf-8', errors='replace') if except_bytes else None
+    text = text_bytes.decode('utf-8', errors='replace')
+    return {"password": password, "exceptions": exceptions, "text": text}
 
+def read_layout(input_file, signature, info=None):
+    info = info or read_wav_info(input_file)
     ptr = len(signature)
-    pass_len = int(''.join(map(str, extract_bits(left_channel[ptr:ptr+16], 16))), 2)
-    ptr += 16
-    except_len = int(''.join(map(str, extract_bits(left_channel[ptr:ptr+16], 16))), 2)
-    ptr += 16
-    text_len = int(''.join(map(str, extract_bits(left_channel[ptr:ptr+16], 16))), 2)
-    ptr += 16
-
-    total_expected = ptr + pass_len + except_len + text_len
-    if total_expected > len(left_channel):
+    # Only the 32-bit versioned header is read first: a trimmed multi-channel payload may end before
+    # the 48 frames the legacy length header needs
+    header = read_left_channel(input_file, ptr, FORMAT_HEADER_BITS, info)
+    if len(header) < FORMAT_HEADER_BITS:
         return {"error": "Corrupted metadata, length exceeds available data"}
+    header_bits = extract_bits(header, FORMAT_HEADER_BITS)
+    if parse_length_header(header_bits[:16])[0] != FORMAT_MARKER:
+        # Pre-versioned layout: three 16-bit bit-lengths, payload at one bit per left-channel sample
+        header = read_left_channel(input_file, ptr, 48, info)
+        if len(header) < 48:
+            return {"error": "Corrupted metadata, length exceeds available data"}
+        lengths = parse_length_header(extract_bits(header, 48))
+        return {"version": 1, "bits_per_sample": 1, "channels": 1, "lengths": lengths,
+                "start": ptr + 48, "body_bits": sum(lengths), "frames": ptr + 48 + sum(lengths)}
+
+    _, version, layout = struct.unpack('>HBB', bits_to_bytes(header_bits[:FORMAT_HEADER_BITS]))
+    bits_per_sample, channels = layout >> 4, layout & 0x0F
+    if version not in SUPPORTED_VERSIONS or not 1 <= bits_per_sample <= MAX_BITS_PER_SAMPLE or channels < 1:
+        return {"error": "Unsupported payload format"}
+
+    ptr += FORMAT_HEADER_BITS
+    if version == 3:
+        # The container starts with a varint length, so a few bytes are enough to size the whole body
+        prefix_bits = read_body(input_file, ptr, 8 * MAX_VARINT_BYTES, bits_per_sample, channels, info)
+        if prefix_bits is None:
+            return {"error": "Corrupted metadata, length exceeds available data"}
+        try:
+            body_bits = 8 * container_size(bits_to_bytes(prefix_bits))
+        except ContainerError:
+            return {"error": "Corrupted metadata, invalid payload length"}
+        lengths = None
+    else:
+        length_bits = read_body(input_file, ptr, 48, bits_per_sample, channels, info)
+        if length_bits is None:
+            return {"error": "Corrupted metadata, length exceeds available data"}
+        lengths = parse_length_header(length_bits)
+        body_bits = 48 + 8 * sum(lengths)
+    return {"version": version, "bits_per_sample": bits_per_sample, "channels": channels, "lengths": lengths,
+            "start": ptr, "body_bits": body_bits, "frames": ptr + body_frames(body_bits, bits_per_sample, channels)}
 
-    pass_bits = ''.join(map(str, extract_bits(left_channel[ptr:ptr+pass_len], pass_len)))
+def payload_frames(input_file, signature, info=None):
+    layout = read_layout(input_file, signature, info)
+    return None if "error" in layout else layout["frames"]
+
+def payload_summary(input_file, signature, info=None):
+    # Version, size and password flag from the first bytes of the body, without reading the rest of it
+    info = info or read_wav_info(input_file)
+    layout = read_layout(input_file, signature, info)
+    if "error" in layout:
+        return layout
+    if layout["version"] == 3:
+        head = read_body(input_file, layout["start"], 8 * (MAX_VARINT_BYTES + 1),
+                         layout["bits_per_sample"], layout["channels"], info)
+        if head is None:
+            return {"error": "Corrupted metadata, length exceeds available data"}
+        try:
+            protected = bool(container_flags(bits_to_bytes(head)) & FLAG_PASSWORD)
+        except ContainerError:
+            return {"error": "Corrupted metadata, invalid payload header"}
+    else:
+        protected = layout["lengths"][0] > 0
+    return {"version": layout["version"], "payload_bytes": (layout["body_bits"] + 7) // 8, "password": protected}
+
+def audio_to_text(input_file, signature, info=None):
+    info = info or read_wav_info(input_file)
+    layout = read_layout(input_file, signature, info)
+    if "error" in layout:
+        return layout
+    if layout["version"] == 1:
+        return legacy_audio_to_text(input_file, layout, info)
+
+    # Only the payload span is read, so decoding cost follows the message size, not the file size
+    body_bits = read_body(input_file, layout["start"], layout["body_bits"], layout["bits_per_sample"], layout["channels"], info)
+    if body_bits is None:
+        return {"error": "Corrupted metadata, length exceeds available data"}
+
+    if layout["version"] == 3:
+        try:
+            return unpack_container(bits_to_bytes(body_bits))
+        except ContainerError as e:
+            return {"error": f"Corrupted payload: {e}"}
+
+    pass_len, except_len, _ = layout["lengths"]
+    body = bits_to_bytes(body_bits)[6:]
+    return decode_fields(body[:pass_len], body[pass_len:pass_len + except_len], body[pass_len + except_len:])
+
+def legacy_audio_to_text(input_file, layout, info=None):
+    pass_len, except_len, text_len = layout["lengths"]
+    payload_len = layout["body_bits"]
+    payload = read_left_channel(input_file, layout["start"], payload_len, info)
+    if payload_len > len(payload):
+        return {"error": "Corrupted metadata, length exceeds available data"}
+
+    ptr = 0
+    pass_bits = extract_bits(payload[ptr:ptr+pass_len], pass_len)
     ptr += pass_len
-    except_bits = ''.join(map(str, extract_bits(left_channel[ptr:ptr+except_len], except_len)))
+    except_bits = extract_bits(payload[ptr:ptr+except_len], except_len)
     ptr += except_len
-    text_bits = ''.join(map(str, extract_bits(left_channel[ptr:ptr+text_len], text_len)))
-
-    password = binary_to_text(pass_bits) if pass_len else None
-    exceptions = binary_to_text(except_bits) if except_len else None
-    text = binary_to_text(text_bits)
+    text_bits = extract_bits(payload[ptr:ptr+text_len], text_len)
 
-    return {"password": password, "exceptions": exceptions, "text": text}
+    return decode_fields(
+        bits_to_bytes(pass_bits) if pass_len else b"",
+        bits_to_bytes(except_bits) if except_len else b"",
+        bits_to_bytes(text_bits)
+    )
@@ -0,0 +1,39 @@
+import io
+import struct
+
+import numpy as np
+
+from audio.processing import KSDATAFORMAT_SUBTYPE_PCM, WAVE_FORMAT_EXTENSIBLE, save_wave
+from steganography.lsb import text_to_audio
+
+SIGNATURE = "1011001110001111"
+
+class Clock:
+    # Stands in for time.monotonic wherever a clock can be injected
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def carrier(channels=2, frames=8000, sample_rate=8000, dtype=np.int16):
+    data = np.random.default_rng(channels).integers(-2000, 2000, size=(frames, channels)).astype(dtype)
+    output = io.BytesIO()
+    save_wave(output, sample_rate, data if channels > 1 else data[:, 0])
+    return output.getvalue()
+
+def encoded(text, song=None, **options):
+    output = io.BytesIO()
+    text_to_audio(text, song or carrier(), output, SIGNATURE, **options)
+    return output.getvalue()
+
+def extensible_wav(frames=2048, sample_rate=96000, channels=6, sampwidth=3):
+    # The WAVE_FORMAT_EXTENSIBLE layout ffmpeg writes for 24-bit, multi-channel or high-rate audio
+    block_align = channels * sampwidth
+    fmt = struct.pack(
+        '<HHIIHHHHI16s', WAVE_FORMAT_EXTENSIBLE, channels, sample_rate, sample_rate * block_align, block_align,
+        8 * sampwidth, 22, 8 * sampwidth, (1 << channels) - 1, KSDATAFORMAT_SUBTYPE_PCM
+    )
+    data = np.random.default_rng(1).integers(0, 256, size=frames * block_align, dtype=np.uint8).tobytes()
+    chunks = b'fmt ' + struct.pack('<I', len(fmt)) + fmt + b'data' + struct.pack('<I', len(data)) + data
+    return b'RIFF' + struct.pack('<I', 4 + len(chunks)) + b'WAVE' + chunks
@@ -0,0 +1,44 @@
+import asyncio
+import contextlib
+
+from aiohttp import web
+
+@contextlib.asynccontextmanager
+async def serve_files(files, honor_range=True, delay=0):
+    # Stand-in for Discord's CDN: serves files[name] at /name, answering Range requests with 206 or,
+    # like some proxies, ignoring them. A value of None answers 500
+    stats = {"requests": [], "in_flight": 0, "max_in_flight": 0}
+
+    async def handler(request):
+        name = request.match_info["name"]
+        if name not in files:
+            raise web.HTTPNotFound()
+        stats["requests"].append(name)
+        stats["in_flight"] += 1
+        stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+        try:
+            await asyncio.sleep(delay)
+            data = files[name]
+            if data is None:
+                return web.Response(status=500)
+            range_header = request.headers.get("Range")
+            if not honor_range or not range_header:
+                return web.Response(body=data)
+            start, _, end = range_header.removeprefix("bytes=").partition("-")
+            start, end = int(start), min(int(end), len(data) - 1)
+            if start >= len(data):
+                return web.Response(status=416)
+            return web.Response(status=206, body=data[start:end + 1])
+        finally:
+            stats["in_flight"] -= 1
+
+    app = web.Application()
+    app.router.add_get("/{name}", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    try:
+        yield f"http://127.0.0.1:{runner.addresses[0][1]}", stats
+    finally:
+        await runner.cleanup()
@@ -0,0 +1,42 @@
+from bot.cache import DecryptCache, check_password, entry_size, hash_password
+from tests.factories import Clock
+
+def test_count_cap_evicts_least_recently_used():
+    cache = DecryptCache(max_entries=2)
+    cache.put("a", {"text": "a"})
+    cache.put("b", {"text": "b"})
+    assert cache.get("a") == {"text": "a"}
+    cache.put("c", {"text": "c"})
+    assert cache.get("b") is None
+    assert cache.get("a") and cache.get("c")
+    assert cache.stats()["entries"] == 2 and cache.stats()["evictions"] == 1
+
+def test_byte_cap_evicts_least_recently_used():
+    value = {"text": "x" * 1000}
+    size = entry_size(value)
+    cache = DecryptCache(max_bytes=2 * size + size // 2)
+    for key in "abc":
+        cache.put(key, value)
+    assert cache.get("a") is None
+    assert cache.stats()["bytes"] == 2 * size and cache.stats()["evictions"] == 1
+    # A value that could never fit is not stored, and evicts nothing
+    cache.put("huge", {"text": "x" * 4000})
+    assert cache.get("huge") is None and cache.stats()["entries"] == 2
+
+def test_ttl_and_stats():
+    clock = Clock()
+    cache = DecryptCache(ttl=60, clock=clock)
+    cache.put("a", {"text": "a"})
+    clock.now = 60
+    assert cache.get("a") == {"text": "a"}
+    assert cache.get("b") is None
+    clock.now = 61
+    assert cache.get("a") is None
+    assert cache.stats() == {"entries": 0, "bytes": 0, "hits": 1, "misses": 2, "evictions": 0, "expirations": 1}
+
+def test_check_password():
+    password_hash = hash_password("hunter2 ✦")
+    assert check_password("hunter2 ✦", password_hash)
+    assert not check_password("hunter2", password_hash)
+    # Salted: the same password never hashes the same way twice
+    assert hash_password("hunter2 ✦")[1] != password_hash[1]
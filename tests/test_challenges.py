@@ -0,0 +1,30 @@
+from bot.challenges import Challenge, ChallengeRegistry
+from tests.factories import Clock
+
+def challenge(text):
+    return Challenge(None, text, None, None)
+
+def test_add_returns_displaced_challenges():
+    registry = ChallengeRegistry(max_pending=2, clock=Clock())
+    first, second, third, fourth = map(challenge, ["first", "second", "third", "fourth"])
+    assert registry.add(1, first) == []
+    # A second prompt for the same user replaces the first
+    assert registry.add(1, second) == [(1, first)]
+    assert registry.add(2, third) == []
+    # A full registry drops its oldest prompt
+    assert registry.add(3, fourth) == [(1, second)]
+    assert len(registry) == 2
+    assert registry.pop(1) is None and registry.pop(3) == fourth
+
+def test_pop_ignores_expired_challenges():
+    clock = Clock()
+    registry = ChallengeRegistry(ttl=60, clock=clock)
+    registry.add(1, challenge("old"))
+    clock.now = 30
+    registry.add(2, challenge("new"))
+    clock.now = 61
+    assert registry.pop(1) is None
+    assert registry.expire() == [(1, challenge("old"))]
+    assert registry.pop(2) == challenge("new")
+    clock.now = 100
+    assert registry.expire() == [] and len(registry) == 0
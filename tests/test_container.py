@@ -0,0 +1,83 @@
+import io
+import struct
+import zlib
+
+import pytest
+
+from audio.processing import probe_wav
+from steganography.container import (
+    FLAG_COMPRESSED, FLAG_EXCEPTION_IDS, FLAG_EXCEPTION_TEXT, MAX_TEXT_BYTES, ContainerError, container_flags,
+    container_size, encode_varint, pack_container, pack_ids, unpack_container
+)
+from steganography.lsb import audio_to_text, text_to_audio
+from tests.factories import SIGNATURE, carrier
+
+def frame(content):
+    return encode_varint(len(content)) + content + struct.pack('>I', zlib.crc32(content))
+
+@pytest.mark.parametrize("password", [None, "pw ✦"])
+@pytest.mark.parametrize("exceptions", [None, ["123", "18446744073709551615"], ["0123", "456"], ["alice"]])
+@pytest.mark.parametrize("text", ["", "hi", "compressible " * 100])
+def test_round_trip(password, exceptions, text):
+    packed = pack_container(password, exceptions, text)
+    assert container_size(packed[:5]) == len(packed)
+    assert unpack_container(packed) == {
+        "password": password, "exceptions": ",".join(exceptions) if exceptions else None, "text": text
+    }
+
+@pytest.mark.parametrize("exceptions", [["0123"], ["+1"], [str(1 << 64)], ["12", ""]])
+def test_non_canonical_ids_fall_back_to_text(exceptions):
+    assert pack_ids(exceptions) is None
+    packed = pack_container(None, exceptions, "hi")
+    assert container_flags(packed) & (FLAG_EXCEPTION_IDS | FLAG_EXCEPTION_TEXT) == FLAG_EXCEPTION_TEXT
+    assert unpack_container(packed)["exceptions"] == ",".join(exceptions)
+
+def test_checksum_mismatch():
+    packed = bytearray(pack_container("pw", ["123"], "hello"))
+    packed[3] ^= 0x01
+    with pytest.raises(ContainerError, match="checksum"):
+        unpack_container(bytes(packed))
+
+@pytest.mark.parametrize("data", [b"", b"\x80", b"\x80\x80\x80"])
+def test_truncated_varint(data):
+    with pytest.raises(ContainerError, match="truncated"):
+        container_size(data)
+    with pytest.raises(ContainerError):
+        unpack_container(data)
+
+def test_overlong_varint():
+    with pytest.raises(ContainerError, match="too long"):
+        unpack_container(b"\xff" * 6)
+
+def test_truncated_body():
+    packed = pack_container(None, None, "hello")
+    with pytest.raises(ContainerError, match="truncated"):
+        unpack_container(packed[:-1])
+
+@pytest.mark.parametrize("flags", [0x10, 0x80, FLAG_EXCEPTION_IDS | FLAG_EXCEPTION_TEXT])
+def test_unknown_flags(flags):
+    data = frame(bytes([flags]) + b"\x00hello")
+    with pytest.raises(ContainerError, match="flags"):
+        unpack_container(data)
+    if flags & 0xF0:
+        with pytest.raises(ContainerError, match="flags"):
+            container_flags(data)
+
+def test_compressed_text_is_bounded():
+    # A small zlib stream that would inflate past MAX_TEXT_BYTES
+    bomb = zlib.compress(b"a" * (MAX_TEXT_BYTES + 1), 9)
+    assert len(bomb) < 2048
+    with pytest.raises(ContainerError, match="compressed"):
+        unpack_container(frame(bytes([FLAG_COMPRESSED]) + bomb))
+    assert unpack_container(frame(bytes([FLAG_COMPRESSED]) + zlib.compress(b"a" * MAX_TEXT_BYTES)))["text"] == "a" * MAX_TEXT_BYTES
+
+def test_audio_to_text_reports_corrupted_payload():
+    output = io.BytesIO()
+    text_to_audio("hello there", carrier(1), output, SIGNATURE, bits_per_sample=1)
+    data = bytearray(output.getvalue())
+    info = probe_wav(bytes(data))
+    # One body bit per mono sample after the signature and the 32-bit header; flip one inside the text
+    sample = len(SIGNATURE) + 32 + 8 * 4
+    data[info.data_offset + sample * info.sampwidth] ^= 0x01
+    result = audio_to_text(bytes(data), SIGNATURE)
+    assert result == {"error": "Corrupted payload: checksum mismatch"}
@@ -0,0 +1,64 @@
+import asyncio
+
+import aiohttp
+import pytest
+
+from audio.processing import HEADER_PREFIX, probe_wav
+from bot.fetch import fetch_payload
+from bot.jobs import decrypt_job
+from steganography.lsb import payload_frames
+from tests.factories import SIGNATURE, carrier, encoded
+from tests.server import serve_files
+
+def long_carrier():
+    return carrier(frames=441000, sample_rate=44100)
+
+def fetch(files, name, honor_range):
+    async def scenario():
+        async with serve_files(files, honor_range=honor_range) as (url, stats), aiohttp.ClientSession() as session:
+            return await fetch_payload(session, f"{url}/{name}", SIGNATURE), stats["requests"]
+    return asyncio.run(scenario())
+
+@pytest.fixture(scope="module")
+def files():
+    return {
+        "secret.wav": encoded("a hidden message " * 50, long_carrier(), password="pw", exceptions=["123"]),
+        "plain.wav": long_carrier(),
+        "notes.wav": b"definitely not a wav file " * 1000,
+    }
+
+@pytest.mark.parametrize("honor_range", [True, False])
+def test_invalid_audio(files, honor_range):
+    result, requests = fetch(files, "notes.wav", honor_range)
+    # Rejected from the first few KB, without reading the rest of the file
+    assert result == {"rejected": "invalid_audio", "bytes_read": HEADER_PREFIX}
+    assert requests == ["notes.wav"]
+
+@pytest.mark.parametrize("honor_range", [True, False])
+def test_verification_failed(files, honor_range):
+    result, requests = fetch(files, "plain.wav", honor_range)
+    info = probe_wav(files["plain.wav"])
+    prefix = (len(SIGNATURE) + 32 + 48) * info.nchannels * info.sampwidth
+    assert result["rejected"] == "verification_failed"
+    if honor_range:
+        assert result["bytes_read"] == HEADER_PREFIX + prefix and len(requests) == 2
+    else:
+        assert result["bytes_read"] == max(HEADER_PREFIX, info.data_offset + prefix) and len(requests) == 1
+
+@pytest.mark.parametrize("honor_range", [True, False])
+def test_payload_prefix_only(files, honor_range):
+    data = files["secret.wav"]
+    result, requests = fetch(files, "secret.wav", honor_range)
+    assert decrypt_job(result["audio"], SIGNATURE)["text"] == "a hidden message " * 50
+
+    info = probe_wav(data)
+    payload_end = info.data_offset + payload_frames(data, SIGNATURE) * info.nchannels * info.sampwidth
+    if honor_range:
+        # One request each for the header, the signature prefix and the rest of the payload
+        assert len(requests) == 3
+        assert result["bytes_read"] == HEADER_PREFIX + payload_end - info.data_offset
+    else:
+        # A single response, read only as far as the end of the payload
+        assert len(requests) == 1
+        assert result["bytes_read"] == max(HEADER_PREFIX, payload_end)
+    assert result["bytes_read"] < len(data) // 10
@@ -0,0 +1,57 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from bot.jobs import JobExecutor, QueueFullError
+
+def nap(seconds):
+    time.sleep(seconds)
+    return os.getpid()
+
+async def settle(executor, deadline=10):
+    started = time.monotonic()
+    while executor.pending and time.monotonic() - started < deadline:
+        await asyncio.sleep(0.05)
+
+@pytest.mark.parametrize("mode", ["thread", "process"])
+def test_timeout_releases_queue_place(mode):
+    async def scenario():
+        executor = JobExecutor(workers=1, mode=mode, timeout=5)
+        try:
+            first = await executor.submit(nap, 0)
+            pool = executor._pool
+            # A process job outlives its timeout by far; its pool is retired and its worker terminated
+            with pytest.raises(asyncio.TimeoutError):
+                await executor.submit(nap, 30 if mode == "process" else 0.3, timeout=0.2)
+            assert executor.pending == 1
+            await settle(executor)
+            assert executor.pending == 0
+            second = await executor.submit(nap, 0)
+            if mode == "process":
+                assert executor._pool is not pool and second != first
+                assert not executor._retired
+            else:
+                assert executor._pool is pool
+        finally:
+            executor.shutdown()
+    asyncio.run(scenario())
+
+@pytest.mark.parametrize("mode", ["thread", "process"])
+def test_queue_full_at_max_queue(mode):
+    async def scenario():
+        executor = JobExecutor(workers=1, mode=mode, max_queue=2)
+        try:
+            running = [asyncio.create_task(executor.submit(nap, 0.2)) for _ in range(2)]
+            await asyncio.sleep(0)
+            assert executor.pending == 2
+            with pytest.raises(QueueFullError):
+                await executor.submit(nap, 0)
+            await asyncio.gather(*running)
+            await settle(executor)
+            assert executor.pending == 0
+            await executor.submit(nap, 0)
+        finally:
+            executor.shutdown()
+    asyncio.run(scenario())
@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from bot.jobs import QueueFullError
+from bot.limits import FairScheduler, RateLimiter
+from tests.factories import Clock
+
+async def enter(scheduler, key, cost, order=None, gate=None):
+    async with scheduler.slot(key, cost):
+        if order is not None:
+            order.append(key)
+        if gate is not None:
+            await gate.wait()
+
+def test_small_job_overtakes_queued_large_jobs():
+    async def scenario():
+        scheduler = FairScheduler(1, clock=Clock())
+        order = []
+        gate = asyncio.Event()
+        tasks = [asyncio.create_task(enter(scheduler, "big", 10, order, gate))]
+        await asyncio.sleep(0)
+        for key, cost in [("big", 10), ("big", 10), ("big", 10), ("small", 1)]:
+            tasks.append(asyncio.create_task(enter(scheduler, key, cost, order)))
+            await asyncio.sleep(0)
+        assert scheduler.waiting == 4
+        gate.set()
+        await asyncio.gather(*tasks)
+        assert order == ["big", "small", "big", "big", "big"]
+        assert scheduler.running == 0
+    asyncio.run(scenario())
+
+def test_rate_limiter_refuses_past_max_wait():
+    clock = Clock()
+    limiter = RateLimiter(user=(2, 60), max_wait=10, clock=clock)
+    assert limiter.acquire(1) == (True, 0.0)
+    assert limiter.acquire(1) == (True, 0.0)
+    granted, wait = limiter.acquire(1)
+    assert not granted and wait == pytest.approx(30)
+    # A refusal reserves nothing, so the wait only shrinks with time
+    clock.now = 25
+    granted, wait = limiter.acquire(1)
+    assert granted and wait == pytest.approx(5)
+    # Another user has a bucket of their own
+    assert limiter.acquire(2) == (True, 0.0)
+
+def test_cancelled_waiter_leaves_queue():
+    async def scenario():
+        scheduler = FairScheduler(1, clock=Clock())
+        async with scheduler.slot("a", 1):
+            waiter = asyncio.create_task(enter(scheduler, "b", 1))
+            await asyncio.sleep(0)
+            waiter.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiter
+            assert scheduler.waiting == 0
+        assert scheduler.running == 0 and not scheduler.busy()
+    asyncio.run(scenario())
+
+def test_cancelled_after_handover_releases_slot():
+    async def scenario():
+        scheduler = FairScheduler(1, clock=Clock())
+        async with scheduler.slot("a", 1):
+            waiter = asyncio.create_task(enter(scheduler, "b", 1))
+            await asyncio.sleep(0)
+        # The slot was handed to the waiter, which is cancelled before it gets to run
+        assert scheduler.running == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert scheduler.running == 0 and not scheduler.busy()
+    asyncio.run(scenario())
+
+def test_queue_full_at_max_waiting():
+    async def scenario():
+        scheduler = FairScheduler(1, max_waiting=1, clock=Clock())
+        async with scheduler.slot("a", 1):
+            waiter = asyncio.create_task(enter(scheduler, "b", 1))
+            await asyncio.sleep(0)
+            with pytest.raises(QueueFullError):
+                async with scheduler.slot("c", 1):
+                    pass
+        await waiter
+        assert scheduler.running == 0
+    asyncio.run(scenario())
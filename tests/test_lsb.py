@@ -0,0 +1,46 @@
+import io
+
+import pytest
+
+from bot.jobs import decrypt_job, encrypt_job
+from steganography.lsb import audio_to_text, text_to_audio
+from tests.factories import SIGNATURE, carrier
+
+@pytest.mark.parametrize("version", [2, 3])
+@pytest.mark.parametrize("bits_per_sample", [None, 1, 2, 4])
+@pytest.mark.parametrize("trim", [False, True])
+@pytest.mark.parametrize("channels", [1, 2, 6, 8])
+@pytest.mark.parametrize("text", ["ok", "a longer secret message ✦ " * 20])
+def test_round_trip(channels, trim, bits_per_sample, version, text):
+    output = io.BytesIO()
+    text_to_audio(text, carrier(channels), output, SIGNATURE, password="pw", exceptions=["123", "456"],
+                  bits_per_sample=bits_per_sample, trim=trim, version=version)
+    assert audio_to_text(output.getvalue(), SIGNATURE) == {"password": "pw", "exceptions": "123,456", "text": text}
+
+@pytest.mark.parametrize("channels", [1, 2, 6, 8])
+def test_trimmed_short_payload_without_password(channels):
+    output = io.BytesIO()
+    text_to_audio("ok", carrier(channels), output, SIGNATURE, trim=True)
+    assert audio_to_text(output.getvalue(), SIGNATURE) == {"password": None, "exceptions": None, "text": "ok"}
+
+@pytest.mark.parametrize("channels", [2, 6, 8])
+def test_encrypt_job_trim_fallback_decrypts(channels):
+    # A long carrier with a small upload limit takes the automatic trim fallback
+    result = encrypt_job(carrier(channels, frames=48000), "ok", SIGNATURE, upload_limit=100000)
+    assert len(result["output"]) <= 100000
+    assert decrypt_job(result["output"], SIGNATURE) == {"exceptions": None, "text": "ok"}
+
+def test_looped_carrier():
+    output = io.BytesIO()
+    text = "looped " * 200
+    text_to_audio(text, carrier(1, frames=64), output, SIGNATURE, bits_per_sample=1)
+    assert audio_to_text(output.getvalue(), SIGNATURE)["text"] == text
+
+@pytest.mark.parametrize("options", [
+    {"bits_per_sample": 0}, {"bits_per_sample": 5}, {"bits_per_sample": 16}, {"version": 1}, {"version": 4}
+])
+def test_rejects_undecodable_layouts(options):
+    output = io.BytesIO()
+    with pytest.raises(ValueError):
+        text_to_audio("ok", carrier(2), output, SIGNATURE, **options)
+    assert output.getvalue() == b""
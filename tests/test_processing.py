@@ -0,0 +1,35 @@
+import io
+
+import pytest
+
+from audio.processing import load_wave, probe_wav, resample_audio_inplace
+from bot.jobs import decrypt_job, encrypt_job
+from steganography.lsb import audio_to_text, text_to_audio
+from tests.factories import SIGNATURE, extensible_wav
+
+# KSDATAFORMAT_SUBTYPE_IEEE_FLOAT differs from the PCM GUID in its first byte
+FLOAT_SUBTYPE = b'\x03\x00\x00\x00\x00\x00\x10\x00\x80\x00\x00\xaa\x00\x38\x9b\x71'
+
+@pytest.mark.parametrize("channels, sampwidth", [(2, 2), (6, 3), (2, 4)])
+def test_extensible_pcm(channels, sampwidth):
+    data = extensible_wav(frames=4800, sample_rate=96000, channels=channels, sampwidth=sampwidth)
+    info = probe_wav(data)
+    assert (info.nchannels, info.sampwidth, info.framerate, info.nframes) == (channels, sampwidth, 96000, 4800)
+    sample_rate, audio, width = load_wave(data, return_sampwidth=True)
+    assert (sample_rate, audio.shape, width) == (96000, (4800, channels), sampwidth)
+
+    output = io.BytesIO()
+    text_to_audio("hello", data, output, SIGNATURE)
+    assert audio_to_text(output.getvalue(), SIGNATURE)["text"] == "hello"
+
+def test_extensible_resample_fallback():
+    carrier = io.BytesIO(extensible_wav(frames=96000, sample_rate=96000, channels=2, sampwidth=3))
+    resample_audio_inplace(carrier, 44100)
+    assert probe_wav(carrier)[1:3] == (2, 44100)
+
+    result = encrypt_job(extensible_wav(frames=96000), "hello", SIGNATURE, upload_limit=400000)
+    assert decrypt_job(result["output"], SIGNATURE)["text"] == "hello"
+
+def test_extensible_float_rejected():
+    data = extensible_wav().replace(extensible_wav()[44:60], FLOAT_SUBTYPE, 1)
+    assert probe_wav(data) is None
@@ -0,0 +1,121 @@
+import asyncio
+import contextlib
+from types import SimpleNamespace
+
+import aiohttp
+import pytest
+
+from bot.scan import MAX_ATTEMPTS, ScanIndex, ScanInterrupted, scan_channel
+from tests.factories import SIGNATURE, carrier, encoded
+from tests.server import serve_files
+
+@pytest.fixture
+def index(tmp_path):
+    index = ScanIndex(str(tmp_path / "index.db"))
+    yield index
+    index.close()
+
+class Channel:
+    # Just enough of a discord channel: history pages and fetch_message
+    def __init__(self, channel_id, base_url, names):
+        self.id = channel_id
+        self.messages = [self.message(i, base_url, name) for i, name in enumerate(names)]
+
+    def message(self, i, base_url, name):
+        attachment = SimpleNamespace(id=self.id * 1000 + i, filename=name, size=0, url=f"{base_url}/{name}")
+        return SimpleNamespace(id=self.id * 1000 + i, channel=self, attachments=[attachment])
+
+    def history(self, limit, after, oldest_first):
+        async def messages():
+            newer = [message for message in self.messages if after is None or message.id > after.id]
+            for message in newer[:limit]:
+                yield message
+        return messages()
+
+    async def fetch_message(self, message_id):
+        return next(message for message in self.messages if message.id == message_id)
+
+def files():
+    return {
+        "open.wav": encoded("hello"),
+        "locked.wav": encoded("secret", password="pw"),
+        "plain.wav": carrier(),
+        "notes.txt": b"not scanned",
+    }
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+def test_incremental_scan(index):
+    async def scenario():
+        data = files()
+        async with serve_files(data) as (url, stats), aiohttp.ClientSession() as session:
+            channel = Channel(1, url, ["open.wav", "plain.wav", "notes.txt", "locked.wav"] * 3)
+            first = await scan_channel(channel, session, SIGNATURE, index, limit=7, page_size=3)
+            assert first == {"messages": 7, "attachments": 5, "payloads": 3, "complete": False, "retry_after": None}
+            second = await scan_channel(channel, session, SIGNATURE, index, limit=7, page_size=3)
+            assert second["messages"] == 5 and second["complete"]
+            requests = len(stats["requests"])
+
+            # Nothing new: the index answers without touching the server
+            assert (await scan_channel(channel, session, SIGNATURE, index))["messages"] == 0
+            assert len(stats["requests"]) == requests
+            payloads = index.payloads(1)
+            assert len(payloads) == 6
+            assert {password for *_, password in payloads} == {True, False}
+    run(scenario())
+
+def test_failed_downloads_are_retried(index):
+    async def scenario():
+        data = files()
+        data["open.wav"] = None
+        async with serve_files(data) as (url, _), aiohttp.ClientSession() as session:
+            channel = Channel(1, url, ["open.wav", "locked.wav"])
+            assert (await scan_channel(channel, session, SIGNATURE, index))["payloads"] == 1
+            assert index.failed(1) == {1000: {1000}}
+
+            data["open.wav"] = encoded("hello")
+            stats = await scan_channel(channel, session, SIGNATURE, index)
+            assert stats["payloads"] == 1 and stats["messages"] == 0
+            assert index.failed(1) == {} and len(index.payloads(1)) == 2
+    run(scenario())
+
+def test_failed_downloads_are_given_up(index):
+    async def scenario():
+        async with serve_files({"broken.wav": None}) as (url, stats), aiohttp.ClientSession() as session:
+            channel = Channel(1, url, ["broken.wav"])
+            for _ in range(MAX_ATTEMPTS + 2):
+                await scan_channel(channel, session, SIGNATURE, index)
+            assert len(stats["requests"]) == MAX_ATTEMPTS
+    run(scenario())
+
+def test_slot_interrupts_scan(index):
+    async def scenario():
+        charged = []
+
+        @contextlib.asynccontextmanager
+        async def slot(attachments):
+            if charged:
+                raise ScanInterrupted(12)
+            charged.append(attachments)
+            yield
+
+        async with serve_files(files()) as (url, _), aiohttp.ClientSession() as session:
+            channel = Channel(1, url, ["open.wav", "notes.txt"] * 4)
+            stats = await scan_channel(channel, session, SIGNATURE, index, page_size=3, slot=slot)
+            assert stats["retry_after"] == 12 and not stats["complete"]
+            assert charged == [2] and stats["messages"] == 3
+            assert index.checkpoint(1) == 1002
+    run(scenario())
+
+def test_shared_semaphore_bounds_concurrent_scans(index):
+    async def scenario():
+        async with serve_files(files(), delay=0.02) as (url, stats), aiohttp.ClientSession() as session:
+            semaphore = asyncio.Semaphore(2)
+            channels = [Channel(i, url, ["open.wav", "locked.wav", "plain.wav"] * 3) for i in range(1, 4)]
+            await asyncio.gather(*(
+                scan_channel(channel, session, SIGNATURE, index, semaphore=semaphore) for channel in channels
+            ))
+            assert stats["max_in_flight"] <= 2
+            assert all(len(index.payloads(channel.id)) == 6 for channel in channels)
+    run(scenario())
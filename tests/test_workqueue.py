@@ -0,0 +1,28 @@
+from bot.workqueue import WorkQueue
+
+def test_reap_stops_abandoned_job(tmp_path):
+    queue = WorkQueue(str(tmp_path / "queue.db"))
+    job_id = queue.put("decrypt_job", (), {}, timeout=60)
+    queue.claim("host:1")
+    queue.cancel(job_id)
+    stopped = []
+    assert queue.abandoned(["host:1"]) == [(job_id, "host:1")]
+    assert queue.reap(job_id, "host:1", lambda: stopped.append(job_id))
+    assert stopped == [job_id] and queue.depth() == 0
+    queue.close()
+
+def test_reap_spares_the_next_job(tmp_path):
+    queue = WorkQueue(str(tmp_path / "queue.db"))
+    cancelled = queue.put("decrypt_job", (), {}, timeout=60)
+    queue.put("decrypt_job", (), {}, timeout=60)
+    queue.claim("host:1")
+    queue.cancel(cancelled)
+    abandoned = queue.abandoned(["host:1"])
+    # The worker finishes the cancelled job and claims the next one before the supervisor acts
+    queue.finish(cancelled, result="late")
+    queue.claim("host:1")
+    stopped = []
+    for job_id, worker in abandoned:
+        assert not queue.reap(job_id, worker, lambda: stopped.append(job_id))
+    assert stopped == [] and queue.depth() == 1
+    queue.close()